@@ -1,21 +1,52 @@
 """rasrss - RSS 訂閱 → 定期將最新 MP3 連結傳給 AI API → 日文逐字稿 → 介面與 GitHub Pages"""
 
+import argparse
+import asyncio
+import bisect
+import difflib
+import functools
+import hashlib
+import heapq
+import html
+import io
+import itertools
+import json
 import os
+import queue
+import random
 import re
+import signal
+import socket
 import sqlite3
+import subprocess
+import sys
+import tempfile
 import threading
 import time
-from datetime import datetime
+import uuid
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 from pathlib import Path
-from urllib.parse import quote
+from urllib.parse import parse_qsl, quote, urlencode, urlsplit
+from xml.etree import ElementTree
 
+import aiohttp
 import feedparser
 import requests
-from apscheduler.schedulers.background import BackgroundScheduler
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
-from flask import Flask, jsonify, render_template, request
+from flask import Flask, Response, jsonify, render_template, request, stream_with_context
 from git import Repo
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 load_dotenv()
 
 app = Flask(__name__)
@@ -32,6 +63,153 @@ SCHEDULE_OPTIONS = [
     ("weekly", 10080, "每週"),
 ]
 
+# 模型熔斷器冷卻秒數：404（模型不存在）長時間停用；429 / 5xx / 逾時依連續失敗次數加倍，上限 MODEL_COOLDOWN_MAX
+MODEL_COOLDOWN_NOT_FOUND = 6 * 3600
+MODEL_COOLDOWN_RATE_LIMIT = 60
+MODEL_COOLDOWN_ERROR = 30
+MODEL_COOLDOWN_MAX = 3600
+# 半開模型試探期間，其他呼叫先跳過它
+MODEL_PROBE_SECONDS = 120
+
+# AI 呼叫配額（預設為免費方案）：(每分鐘請求數, 每日請求數)，0 = 不限制。鍵為 (provider, model)：
+# model 為 "*" 是該 provider 每個模型各自的預設值，None 是整個 provider 共用的額度。
+# 每分鐘以 token bucket 平滑，每日依資料庫中當日（UTC）的請求數判斷，重啟後延續
+MODEL_QUOTAS = {
+    ("gemini", "*"): (10, 250),
+    ("gemini", "gemini-2.0-flash"): (15, 200),
+    ("openrouter", None): (20, 50),
+}
+# 額度在這麼多秒內會恢復就在 worker 內等待；否則工作延後執行（不算失敗），且至少隔 QUOTA_DEFER_MIN 秒
+QUOTA_MAX_WAIT = 60
+QUOTA_DEFER_MIN = 60
+# 每日請求數的快取秒數：超過就重新讀取資料庫中的當日合計（含其他行程，例如 API 行程的 ai-test）
+QUOTA_REFRESH_SECONDS = 5
+# /api/usage 預設統計最近幾天、上限
+USAGE_DEFAULT_DAYS = 30
+USAGE_MAX_DAYS = 366
+
+# 全文搜尋：每頁筆數、上限，以及 snippet 前後保留的 token 數；SEARCH_AVAILABLE 於 init_db 時判定
+SEARCH_PAGE_SIZE = 20
+SEARCH_PAGE_MAX = 100
+SEARCH_SNIPPET_TOKENS = 24
+SEARCH_AVAILABLE = False
+
+# SQLite 遇到鎖定時最多等待秒數
+DB_BUSY_TIMEOUT = 30
+
+# 共用 HTTP 連線池大小（每個 host 保留的 keep-alive 連線數）
+HTTP_POOL_SIZE = 16
+
+# RSS 邊讀邊解析：每次從連線讀取的 bytes
+FEED_CHUNK_BYTES = 16 * 1024
+
+# MP3 下載：不超過此大小放記憶體，否則落地為匿名暫存檔；支援 Range 且夠大的檔案平行分段下載
+AUDIO_SPOOL_MAX_BYTES = 32 * 1024 * 1024
+DOWNLOAD_PARTS = 4
+RANGE_MIN_BYTES = 4 * 1024 * 1024
+
+# 音訊指紋去重：讀取開頭與結尾各多少 bytes 計算內容雜湊（0 = 只用網址、大小與 ETag）
+FINGERPRINT_HEAD_BYTES = 64 * 1024
+# 比對網址時去掉的 CDN 簽章 / 追蹤參數（小寫；結尾 * 為前綴）；其他查詢參數（例如 ?id=）會區分不同集數
+AUDIO_URL_IGNORED_PARAMS = (
+    "expires", "signature", "key-pair-id", "policy", "token", "hdnts", "x-amz-*", "x-goog-*", "utm_*",
+    "aid", "awcollectionid", "awepisodeid", "listeningsessionid", "ttag", "_from", "nocache",
+)
+
+# 上傳後等待 Gemini 檔案變為 ACTIVE：指數退避的初始 / 最大間隔與整體期限（秒）
+FILE_POLL_INITIAL = 1
+FILE_POLL_MAX = 15
+FILE_ACTIVE_TIMEOUT = 600
+
+# 長節目分段轉錄：預設每段分鐘數（0 = 不分段）、同時轉錄段數、段與段的重疊秒數、單段重試
+DEFAULT_SEGMENT_MINUTES = 10
+MAX_SEGMENT_MINUTES = 120
+DEFAULT_SEGMENT_PARALLELISM = 3
+MAX_SEGMENT_PARALLELISM = 8
+SEGMENT_OVERLAP_SECONDS = 20
+SEGMENT_ATTEMPTS = 3
+SEGMENT_RETRY_INITIAL = 5
+SEGMENT_RETRY_MAX = 60
+# 接合時只在前段結尾 / 後段開頭這麼多字內找重疊：相同片段至少要這麼長，且須位於前段結尾與後段開頭
+# （片段前後未對上的字數加上片段本身，即推算的重疊長度，不超過視窗），並佔推算重疊長度的 STITCH_MIN_COVERAGE 以上
+STITCH_WINDOW_CHARS = 400
+STITCH_MIN_MATCH_CHARS = 16
+STITCH_MIN_COVERAGE = 0.5
+TRANSCRIBE_PROMPT = "此為日文音訊。請產出完整逐字稿，一字不漏、不摘要，只輸出日文文字，不要其他說明。"
+
+# GitHub Pages 發佈：累積到這麼多篇或最早一篇等了這麼久（秒）就合併為一次 commit + push；push 重試
+PUBLISH_WINDOW_SECONDS = 60
+PUBLISH_BATCH_SIZE = 10
+PUBLISH_PUSH_ATTEMPTS = 3
+PUBLISH_RETRY_INITIAL = 5
+PUBLISH_RETRY_MAX = 60
+
+# 正式部署（python app.py serve）：API 行程數（RASRSS_WEB_WORKERS）、每個行程的執行緒數與預設綁定位址
+SERVE_WORKERS = max(1, int(os.getenv("RASRSS_WEB_WORKERS", "2")))
+SERVE_THREADS = 8
+SERVE_BIND = "0.0.0.0:5001"
+
+# 排程租約：只有持有租約的行程執行排程與轉錄；持有者每 LEASE_RENEW_SECONDS 秒續約，
+# 超過 LEASE_TTL_SECONDS 秒未續約（當機或卡住）由待命的行程接手；排程行程結束後隔 PIPELINE_RESTART_SECONDS 秒重新啟動
+LEASE_TTL_SECONDS = 30
+LEASE_RENEW_SECONDS = 10
+PIPELINE_RESTART_SECONDS = 5
+# API 行程留下的請求（手動執行、新增訂閱）由排程行程每隔幾秒取出；排程行程的內部狀態端點埠號（0 = 自動選擇）
+PIPELINE_INTAKE_SECONDS = 2
+PIPELINE_STATUS_PORT = int(os.getenv("RASRSS_PIPELINE_PORT", "0"))
+
+# 工作佇列：同時執行的 worker 數（可用環境變數 RASRSS_JOB_WORKERS 調整）與保留的已完成紀錄數
+JOB_WORKERS = max(1, int(os.getenv("RASRSS_JOB_WORKERS", "2")))
+JOB_HISTORY = 100
+
+# 工作進度事件（/api/events SSE）：保留最近幾筆供重連補送、每個連線的佇列上限、心跳間隔（秒）
+EVENT_HISTORY = 200
+EVENT_QUEUE_SIZE = 500
+EVENT_HEARTBEAT_SECONDS = 15
+# 每條 SSE 串流佔用一個 API 執行緒直到連線結束：每個行程同時開啟的串流上限（預設為 gthread 執行緒數的一半，
+# 可用環境變數 RASRSS_EVENT_MAX_STREAMS 調整），超過時回 503 請瀏覽器 EVENT_RETRY_SECONDS 秒後重連；
+# 單一串流最長 EVENT_STREAM_MAX_SECONDS 秒，到期結束讓名額輪替，瀏覽器依 Last-Event-ID 重連補送
+EVENT_MAX_STREAMS = max(1, int(os.getenv("RASRSS_EVENT_MAX_STREAMS", str(SERVE_THREADS // 2))))
+EVENT_RETRY_SECONDS = 30
+EVENT_STREAM_MAX_SECONDS = 300
+
+# /metrics 各階段耗時 histogram 的 bucket 上界（秒），涵蓋 RSS 抓取到長節目轉錄
+METRIC_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+# 優先序：數字越小越先執行；手動「立即執行」優先於排程
+PRIORITY_MANUAL = 0
+PRIORITY_SCHEDULED = 10
+
+# 每個 feed 依資料庫中的 next_run_at 各自排程：失敗後自 FEED_RETRY_INITIAL 秒起指數退避（上限 FEED_RETRY_MAX），
+# 每次延遲再加上 FEED_JITTER_RATIO 比例內的隨機抖動分散負載
+FEED_RETRY_INITIAL = 5 * 60
+FEED_RETRY_MAX = 12 * 3600
+FEED_JITTER_RATIO = 0.05
+
+# 排程輪詢（asyncio）：同時檢查的 feed 上限（可用環境變數 RASRSS_POLL_CONCURRENCY 調整）、同一 host 同時請求數、
+# 單一 feed 逾時秒數；輪詢執行緒最多睡 POLL_MAX_SLEEP 秒就重新查一次到期的 feed
+POLL_CONCURRENCY = max(1, int(os.getenv("RASRSS_POLL_CONCURRENCY", "100")))
+POLL_PER_HOST = 4
+POLL_FEED_TIMEOUT = 30
+POLL_MAX_SLEEP = 300
+
+# 每次最多補抓幾則未處理的集數（由新往舊算），可依訂閱個別設定
+DEFAULT_MAX_BACKLOG = 5
+MAX_BACKLOG_LIMIT = 50
+
+# OPML 匯入：同時驗證的 RSS 數、單次匯入上限；匯出時週期與補抓集數以此命名空間的屬性保存
+IMPORT_WORKERS = 8
+IMPORT_MAX_FEEDS = 1000
+OPML_NAMESPACE = "https://github.com/kapazvuciarwin-art/rasrss"
+
+# 逐字稿列表分頁與預覽長度
+TRANSCRIPT_PAGE_SIZE = 20
+TRANSCRIPT_PAGE_MAX = 100
+TRANSCRIPT_PREVIEW_CHARS = 120
+
+# 逐字稿全文壓縮後存於 transcript_bodies（有安裝 zstandard 用 zstd，否則 zlib）；主表只留預覽與字數
+TRANSCRIPT_ZSTD_LEVEL = 10
+TRANSCRIPT_ZLIB_LEVEL = 9
+
 # 逐字稿使用 AI Studio Gemini（下載 MP3 後上傳給 Gemini 轉錄）
 # AI Studio Gemini：優先 3.0 Flash 相關，再 2.5、2.0
 GEMINI_MODEL_PRIORITY = [
@@ -57,14 +235,65 @@ OPENROUTER_FREE_MODELS = [
 ]
 
 
+_db_local = threading.local()
+
+
 def get_db():
-    conn = sqlite3.connect(DATABASE)
+    """目前執行緒共用的 SQLite 連線（WAL + busy timeout），同一執行緒重複使用、不需自行關閉。
+
+    寫入請包在 transaction() 內；單純讀取可直接 execute。
+    """
+    conn = getattr(_db_local, "conn", None)
+    if conn is not None and _db_local.path == DATABASE:
+        return conn
+    if conn is not None:
+        conn.close()
+    conn = sqlite3.connect(DATABASE, timeout=DB_BUSY_TIMEOUT)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT * 1000)}")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    # 短搜尋詞（少於 3 字、無法用 trigram 索引）的 LIKE 搜尋需要在 SQL 內解壓縮逐字稿；schema 不依賴此函式
+    conn.create_function("inflate_transcript", 2, decompress_transcript, deterministic=True)
+    _db_local.conn = conn
+    _db_local.path = DATABASE
+    _db_local.depth = 0
     return conn
 
 
-def init_db():
+def close_db():
+    """關閉目前執行緒的連線（請求結束時呼叫）。"""
+    conn = getattr(_db_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _db_local.conn = None
+
+
+@contextmanager
+def transaction():
+    """在目前執行緒的連線上開交易：正常結束 commit、例外 rollback；可巢狀，只有最外層提交。"""
     conn = get_db()
+    depth = _db_local.depth
+    _db_local.depth = depth + 1
+    try:
+        yield conn
+        if depth == 0:
+            conn.commit()
+    except BaseException:
+        if depth == 0:
+            conn.rollback()
+        raise
+    finally:
+        _db_local.depth = depth
+
+
+def init_db():
+    with transaction() as conn:
+        _create_schema(conn)
+    Path(PAGES_DIR).mkdir(parents=True, exist_ok=True)
+
+
+def _create_schema(conn):
     conn.execute("""
         CREATE TABLE IF NOT EXISTS feeds (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -76,14 +305,25 @@ def init_db():
             created_at TEXT NOT NULL
         )
     """)
-    # 升級：若舊表沒有 last_error 則新增
+    # 升級：舊表缺少的欄位逐一新增（last_error、條件式 GET 的 ETag / Last-Modified / 內容雜湊、補抓上限、排程狀態）
     try:
         cursor = conn.execute("PRAGMA table_info(feeds)")
         cols = [r[1] for r in cursor.fetchall()]
-        if "last_error" not in cols:
-            conn.execute("ALTER TABLE feeds ADD COLUMN last_error TEXT")
+        for col, decl in (
+            ("last_error", "TEXT"),
+            ("etag", "TEXT"),
+            ("last_modified", "TEXT"),
+            ("content_hash", "TEXT"),
+            ("max_backlog", f"INTEGER NOT NULL DEFAULT {DEFAULT_MAX_BACKLOG}"),
+            ("next_run_at", "TEXT"),
+            ("fail_count", "INTEGER NOT NULL DEFAULT 0"),
+        ):
+            if col not in cols:
+                conn.execute(f"ALTER TABLE feeds ADD COLUMN {col} {decl}")
     except Exception:
         pass
+    # 排程輪詢依 next_run_at 找出到期的 feed
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_feeds_next_run ON feeds (next_run_at)")
     conn.execute("""
         CREATE TABLE IF NOT EXISTS transcripts (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -93,9 +333,39 @@ def init_db():
             mp3_url TEXT NOT NULL,
             transcript_text TEXT NOT NULL,
             created_at TEXT NOT NULL,
+            page_slug TEXT,
             FOREIGN KEY (feed_id) REFERENCES feeds(id)
         )
     """)
+    # 升級：舊表沒有 page_slug（GitHub Pages 檔名）則新增，舊資料由標題與建立時間推算
+    cols = [r[1] for r in conn.execute("PRAGMA table_info(transcripts)").fetchall()]
+    if "page_slug" not in cols:
+        conn.execute("ALTER TABLE transcripts ADD COLUMN page_slug TEXT")
+    # 全文壓縮後另存；主表的 transcript_text 留空字串，列表只讀 preview 與 transcript_length
+    for col, decl in (("preview", "TEXT"), ("transcript_length", "INTEGER")):
+        if col not in cols:
+            conn.execute(f"ALTER TABLE transcripts ADD COLUMN {col} {decl}")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS transcript_bodies (
+            transcript_id INTEGER PRIMARY KEY,
+            codec TEXT NOT NULL,
+            body BLOB NOT NULL,
+            FOREIGN KEY (transcript_id) REFERENCES transcripts(id)
+        )
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS transcripts_bodies_bd BEFORE DELETE ON transcripts BEGIN
+            DELETE FROM transcript_bodies WHERE transcript_id = old.id;
+        END
+    """)
+    _migrate_transcript_bodies(conn)
+    # 列表以 (created_at, id) 做 keyset 分頁；SQLite 索引尾端隱含 rowid，故可直接涵蓋 id
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_transcripts_feed_created ON transcripts (feed_id, created_at)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_transcripts_created ON transcripts (created_at)"
+    )
     conn.execute("""
         CREATE TABLE IF NOT EXISTS episode_done (
             feed_id INTEGER NOT NULL,
@@ -107,89 +377,1054 @@ def init_db():
     conn.execute("""
         CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)
     """)
-    conn.commit()
-    conn.close()
-    Path(PAGES_DIR).mkdir(parents=True, exist_ok=True)
+    # 音訊內容指紋 → 逐字稿：同一份音訊換了網址或重新上架時直接沿用，不再呼叫 Gemini
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS audio_fingerprints (
+            fingerprint TEXT NOT NULL,
+            transcript_id INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            PRIMARY KEY (fingerprint, transcript_id),
+            FOREIGN KEY (transcript_id) REFERENCES transcripts(id)
+        )
+    """)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_audio_fingerprints_transcript ON audio_fingerprints (transcript_id)"
+    )
+    # 排程租約（選出唯一的排程行程）與 API 行程交給排程行程的請求
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            address TEXT,
+            expires_at REAL NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS pipeline_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            feed_id INTEGER,
+            created_at TEXT NOT NULL
+        )
+    """)
+    # AI 用量：每日（UTC）各模型、各 feed 的請求數（含 429）、tokens 與送出的音訊秒數；feed_id 0 為連線測試等非訂閱呼叫
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS model_usage (
+            day TEXT NOT NULL,
+            provider TEXT NOT NULL,
+            model TEXT NOT NULL,
+            feed_id INTEGER NOT NULL DEFAULT 0,
+            requests INTEGER NOT NULL DEFAULT 0,
+            rate_limited INTEGER NOT NULL DEFAULT 0,
+            input_tokens INTEGER NOT NULL DEFAULT 0,
+            output_tokens INTEGER NOT NULL DEFAULT 0,
+            audio_seconds REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, provider, model, feed_id)
+        )
+    """)
+    _create_search_index(conn)
+
+
+def compress_transcript(text):
+    """壓縮逐字稿全文，回傳 (codec, blob)。"""
+    data = text.encode("utf-8")
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=TRANSCRIPT_ZSTD_LEVEL).compress(data)
+    return "zlib", zlib.compress(data, TRANSCRIPT_ZLIB_LEVEL)
+
+
+def decompress_transcript(codec, body):
+    if body is None:
+        return None
+    if codec == "zlib":
+        return zlib.decompress(body).decode("utf-8")
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("此逐字稿以 zstd 壓縮，請安裝：pip install zstandard")
+        return zstandard.ZstdDecompressor().decompress(body).decode("utf-8")
+    raise ValueError(f"未知的逐字稿壓縮格式：{codec}")
+
+
+def _insert_transcript_body(conn, transcript_id, text):
+    codec, body = compress_transcript(text)
+    conn.execute(
+        "INSERT INTO transcript_bodies (transcript_id, codec, body) VALUES (?, ?, ?)",
+        (transcript_id, codec, body),
+    )
+
+
+def load_transcript_text(transcript_id):
+    """讀取並解壓縮單篇逐字稿全文；找不到時回傳 None。"""
+    row = get_db().execute(
+        "SELECT codec, body FROM transcript_bodies WHERE transcript_id = ?", (transcript_id,)
+    ).fetchone()
+    return decompress_transcript(row["codec"], row["body"]) if row else None
+
+
+def save_transcript(conn, feed_id, title, link, mp3_url, text, created_at, slug):
+    """新增逐字稿：主表存預覽與字數，全文壓縮存入 transcript_bodies；回傳逐字稿 id。須在交易內呼叫。"""
+    transcript_id = conn.execute(
+        """INSERT INTO transcripts (feed_id, episode_title, episode_url, mp3_url, transcript_text, created_at,
+                                    page_slug, preview, transcript_length)
+           VALUES (?, ?, ?, ?, '', ?, ?, ?, ?)""",
+        (feed_id, title, link, mp3_url, created_at, slug, text[:TRANSCRIPT_PREVIEW_CHARS], len(text)),
+    ).lastrowid
+    _insert_transcript_body(conn, transcript_id, text)
+    index_transcript(conn, transcript_id, title, text)
+    return transcript_id
+
+
+def _migrate_transcript_bodies(conn):
+    """升級：把仍存在主表的全文壓縮搬到 transcript_bodies，並補上預覽與字數。
+
+    舊版全文索引以 transcripts.transcript_text 為內容來源，先移除，之後由 _create_search_index 依新來源重建。
+    """
+    old_fts = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE name = 'transcripts_fts' AND sql LIKE '%content=''transcripts''%'"
+    ).fetchone()
+    if old_fts:
+        for trigger in ("transcripts_fts_ai", "transcripts_fts_ad", "transcripts_fts_au"):
+            conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        conn.execute("DROP TABLE transcripts_fts")
+    ids = [r[0] for r in conn.execute("SELECT id FROM transcripts WHERE transcript_text != ''").fetchall()]
+    for start in range(0, len(ids), 200):
+        chunk = ids[start:start + 200]
+        marks = ",".join("?" * len(chunk))
+        rows = conn.execute(f"SELECT id, transcript_text FROM transcripts WHERE id IN ({marks})", chunk).fetchall()
+        for row in rows:
+            text = row["transcript_text"]
+            conn.execute("DELETE FROM transcript_bodies WHERE transcript_id = ?", (row["id"],))
+            _insert_transcript_body(conn, row["id"], text)
+            conn.execute(
+                "UPDATE transcripts SET transcript_text = '', preview = ?, transcript_length = ? WHERE id = ?",
+                (text[:TRANSCRIPT_PREVIEW_CHARS], len(text), row["id"]),
+            )
+    if ids:
+        print(f"[rasrss] 已壓縮 {len(ids)} 篇逐字稿全文（執行 VACUUM 可釋放空間）")
+
+
+def _create_search_index(conn):
+    """全文搜尋：FTS5 trigram（日文無空白斷詞）contentless 表，只存索引不重複存全文。
+
+    索引由 Python 在寫入 / 刪除逐字稿的同一筆交易內維護（index_transcript / delete_feed_transcripts），
+    schema 不依賴 Python UDF，任何連線（含 sqlite3 CLI）都能照常新增與刪除逐字稿。
+    SQLite 不支援 FTS5 或 trigram（3.34 以前）時略過，/api/search 會回報不可用。
+    """
+    global SEARCH_AVAILABLE
+    # 升級：舊版以 inflate_transcript() 的 view 為內容來源、由 trigger 同步，其他連線沒有此函式就無法寫入
+    for trigger in ("transcript_bodies_fts_ai", "transcript_bodies_fts_ad"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    if conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'transcripts_fts' AND sql LIKE '%transcripts_fts_content%'"
+    ).fetchone():
+        conn.execute("DROP TABLE transcripts_fts")
+    conn.execute("DROP VIEW IF EXISTS transcripts_fts_content")
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'transcripts_fts'").fetchone()
+    try:
+        conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS transcripts_fts USING fts5(
+                episode_title, transcript_text, content='', tokenize='trigram'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        SEARCH_AVAILABLE = False
+        print(f"[rasrss] 全文搜尋停用（SQLite 不支援 FTS5 trigram）: {e}")
+        return
+    SEARCH_AVAILABLE = True
+    if not exists:
+        # 第一次建立索引時一併補上既有的逐字稿
+        rebuild_search_index()
+
+
+def index_transcript(conn, transcript_id, title, text):
+    """將逐字稿加入全文索引（rowid 即逐字稿 id）。須與寫入逐字稿在同一筆交易內呼叫。"""
+    if SEARCH_AVAILABLE:
+        conn.execute(
+            "INSERT INTO transcripts_fts (rowid, episode_title, transcript_text) VALUES (?, ?, ?)",
+            (transcript_id, title, text),
+        )
+
+
+def delete_feed_transcripts(conn, feed_id):
+    """刪除訂閱的所有逐字稿與其音訊指紋、全文索引。須在交易內呼叫。
+
+    contentless FTS 刪除時須提供當初索引的原文，因此先在 Python 解壓縮再送出 'delete'。
+    """
+    if SEARCH_AVAILABLE:
+        rows = conn.execute(
+            "SELECT t.id, t.episode_title, b.codec, b.body "
+            "FROM transcripts t JOIN transcript_bodies b ON b.transcript_id = t.id WHERE t.feed_id = ?",
+            (feed_id,),
+        ).fetchall()
+        for row in rows:
+            conn.execute(
+                "INSERT INTO transcripts_fts (transcripts_fts, rowid, episode_title, transcript_text) "
+                "VALUES ('delete', ?, ?, ?)",
+                (row["id"], row["episode_title"], decompress_transcript(row["codec"], row["body"])),
+            )
+    conn.execute(
+        "DELETE FROM audio_fingerprints WHERE transcript_id IN (SELECT id FROM transcripts WHERE feed_id = ?)",
+        (feed_id,),
+    )
+    conn.execute("DELETE FROM transcripts WHERE feed_id = ?", (feed_id,))
+
+
+def rebuild_search_index():
+    """由逐字稿全文重新建立全文索引（補建既有資料或索引損毀時使用），回傳索引筆數。"""
+    count = 0
+    with transaction() as conn:
+        conn.execute("INSERT INTO transcripts_fts (transcripts_fts) VALUES ('delete-all')")
+        rows = conn.execute(
+            "SELECT t.id, t.episode_title, b.codec, b.body "
+            "FROM transcripts t JOIN transcript_bodies b ON b.transcript_id = t.id"
+        )
+        for row in rows:
+            index_transcript(conn, row["id"], row["episode_title"], decompress_transcript(row["codec"], row["body"]))
+            count += 1
+    return count
+
+
+class Metrics:
+    """Prometheus 文字格式的最小實作：histogram 與 counter 依 label 組合累計，gauge 於抓取時才計算。"""
+
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self._buckets = buckets
+        self._meta = {}  # name -> (type, help)
+        self._values = {}  # name -> {labels: 數值或 [各 bucket 次數, 總和, 次數]}
+        self._gauges = {}  # name -> 回傳數值的函式
+
+    def describe(self, name, kind, help_text, fn=None):
+        self._meta[name] = (kind, help_text)
+        self._values.setdefault(name, {})
+        if fn is not None:
+            self._gauges[name] = fn
+
+    def inc(self, name, amount=1, **labels):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            values = self._values[name]
+            values[key] = values.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            values = self._values[name]
+            entry = values.get(key)
+            if entry is None:
+                entry = values[key] = [[0] * (len(self._buckets) + 1), 0.0, 0]
+            entry[0][bisect.bisect_left(self._buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @staticmethod
+    def _labels(pairs):
+        if not pairs:
+            return ""
+        escaped = (
+            f'{k}="' + str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+            for k, v in pairs
+        )
+        return "{" + ",".join(escaped) + "}"
+
+    def render(self):
+        # gauge 函式會取用其他元件的鎖，先在持有本鎖之外求值
+        gauges = {name: fn() for name, fn in self._gauges.items()}
+        lines = []
+        with self._lock:
+            for name, (kind, help_text) in self._meta.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                if name in self._gauges:
+                    lines.append(f"{name} {gauges[name]}")
+                    continue
+                for key, value in sorted(self._values[name].items()):
+                    if kind != "histogram":
+                        lines.append(f"{name}{self._labels(key)} {value}")
+                        continue
+                    counts, total, count = value
+                    cumulative = 0
+                    for bound, n in zip((*self._buckets, "+Inf"), counts):
+                        cumulative += n
+                        lines.append(f"{name}_bucket{self._labels((*key, ('le', bound)))} {cumulative}")
+                    lines.append(f"{name}_sum{self._labels(key)} {round(total, 6)}")
+                    lines.append(f"{name}_count{self._labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics(METRIC_BUCKETS)
+METRICS.describe(
+    "rasrss_stage_seconds", "histogram",
+    "各階段耗時：rss_fetch、parse、download、upload、wait_active、quota_wait（等待 AI 配額）、generate、db_write、git_push、poll_tick（一輪排程輪詢）",
+)
+METRICS.describe("rasrss_episodes_total", "counter", "集數處理結果：success、failure、skip（已處理或音訊相同）、deferred（AI 配額用盡，延後執行）")
+METRICS.describe("rasrss_jobs_total", "counter", "工作佇列完成的工作數（依種類與結果）")
+METRICS.describe("rasrss_retries_total", "counter", "重試次數：segment（分段轉錄）、model（換下一個模型）、git_push")
+METRICS.describe(
+    "rasrss_feed_fetch_total", "counter",
+    "RSS 取得結果：not_modified、hit（內容未變）、partial（讀到已處理的集數即停止）、miss（讀完整份）",
+)
+METRICS.describe("rasrss_feed_bytes_total", "counter", "讀取的 RSS 內容 bytes（依 feed）")
+METRICS.describe("rasrss_model_tokens_total", "counter", "AI 呼叫使用的 tokens（依 provider、模型與 input / output）")
+
+
+def _feed_label(feed=None):
+    """metrics 的 feed label：未指定時取目前工作的 feed（不在工作中時為空字串）。"""
+    if feed is None:
+        job = JOBS.current()
+        feed = job.feed_id if job is not None and job.feed_id is not None else ""
+    return feed
+
+
+def observe_stage(stage, seconds, model="", feed=None):
+    """記錄一個階段的耗時；feed 預設取目前工作的 feed。"""
+    METRICS.observe("rasrss_stage_seconds", seconds, stage=stage, feed=_feed_label(feed), model=model)
+
+
+@contextmanager
+def stage_timer(stage, model=""):
+    """量測 with 區塊耗時（含失敗的情況）並記入 rasrss_stage_seconds。"""
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.monotonic() - started, model)
+
+
+def _make_http_session():
+    """共用 HTTP session：keep-alive 連線池，RSS、MP3 與 API 呼叫共用。"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = "rasrss/1.0"
+    return session
+
+
+HTTP = _make_http_session()
+
+# RSS 取得統計：not_modified = 伺服器回 304；hit = 回 200 但內容雜湊未變；
+# partial = 讀到已處理的集數（或足夠集數）即停止讀取；miss = 內容有變且整份讀完
+FEED_FETCH_STATS = {"not_modified": 0, "hit": 0, "partial": 0, "miss": 0}
+_stats_lock = threading.Lock()
+
+
+def _count_feed_fetch(kind):
+    with _stats_lock:
+        FEED_FETCH_STATS[kind] += 1
+    METRICS.inc("rasrss_feed_fetch_total", result=kind)
+
+
+def _conditional_headers(etag, last_modified):
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    return headers
+
+
+class FeedStream:
+    """邊讀邊解析 RSS / Atom：逐段 feed() 原始 bytes，以 XMLPullParser 取出含音訊的項目。
+
+    確認項目為新到舊排列後，讀到已處理的集數（is_known 回傳 True）或累積 depth 個項目即可停止讀取；
+    XML 格式有誤（未定義的 HTML entity 等）或 expat 不支援的編碼（如 Shift_JIS）時，改為讀完整份內容交給 feedparser。
+    """
+
+    def __init__(self, is_known=None, depth=None):
+        self._is_known = is_known
+        self._depth = depth
+        self._parser = ElementTree.XMLPullParser(events=("start", "end"))
+        self._chunks = []
+        self._hash = hashlib.sha1()
+        self._items = []  # [(發佈時間, (title, link, mp3_url)), ...]，文件順序
+        self._in_items = False
+        self.title = None  # 頻道（feed）標題：第一個項目之前的 <title>
+        self._newest_first = True
+        self._reached_known = False
+        self.malformed = False
+        self.stopped = False
+        self.bytes_read = 0
+        self.parse_seconds = 0.0
+
+    def feed(self, chunk):
+        """餵入一段內容；回傳 True 表示已取得足夠項目，不必再讀。"""
+        started = time.perf_counter()
+        self.bytes_read += len(chunk)
+        self._hash.update(chunk)
+        self._chunks.append(chunk)
+        if not self.malformed:
+            try:
+                self._parser.feed(chunk)
+                self._read_events()
+            except (ElementTree.ParseError, ValueError):
+                self.malformed = True
+        self.parse_seconds += time.perf_counter() - started
+        return self.stopped
+
+    def close(self):
+        """整份內容讀完（未提早停止）時呼叫；格式有誤則在此以 feedparser 重新解析。"""
+        started = time.perf_counter()
+        if not self.malformed:
+            try:
+                self._parser.close()
+                self._read_events()
+            except ElementTree.ParseError:
+                self.malformed = True
+        if self.malformed:
+            feed = feedparser.parse(b"".join(self._chunks))
+            self._items = _feed_items(feed)
+            self.title = (feed.feed.get("title") or "").strip() or None
+        self._chunks = []
+        self.parse_seconds += time.perf_counter() - started
+
+    @property
+    def content_hash(self):
+        """整份內容的雜湊；提早停止時沒有完整內容，為 None。"""
+        return None if self.stopped else self._hash.hexdigest()
+
+    def episodes(self):
+        """目前取得的集數，由舊到新：[(title, link, mp3_url), ...]。"""
+        return _order_episodes(list(self._items))
+
+    def _read_events(self):
+        for event, elem in self._parser.read_events():
+            name = _local_name(elem.tag)
+            if event == "start":
+                self._in_items = self._in_items or name in ("item", "entry")
+                continue
+            if name == "title" and not self._in_items and self.title is None:
+                self.title = (elem.text or "").strip() or None
+            if name not in ("item", "entry"):
+                continue
+            item = _item_episode(elem)
+            elem.clear()
+            if item is not None:
+                self._add(item)
+            if self.stopped:
+                break
+
+    def _add(self, item):
+        published, (_, _, mp3_url) = item
+        previous = self._items[-1][0] if self._items else None
+        if published and previous and tuple(published) > tuple(previous):
+            # 由舊到新排列的 feed 要讀到最後才看得到最新的集數，不提早停止
+            self._newest_first = False
+        self._items.append(item)
+        if not self._newest_first:
+            return
+        if self._is_known and not self._reached_known:
+            self._reached_known = self._is_known(mp3_url)
+        # 至少看過兩個項目才能確認排列順序
+        if len(self._items) >= 2 and (self._reached_known or (self._depth and len(self._items) >= self._depth)):
+            self.stopped = True
+            self._chunks = []
+
+
+def _local_name(tag):
+    return tag.rsplit("}", 1)[-1] if isinstance(tag, str) else ""
+
+
+def _is_audio(mime, href):
+    mime = (mime or "").lower()
+    return "audio" in mime or "mpeg" in mime or href.lower().endswith(".mp3")
+
+
+def _parse_item_date(text):
+    """RSS pubDate（RFC 822）或 Atom published（ISO 8601）轉為 UTC struct_time；無法解析回傳 None。"""
+    text = (text or "").strip()
+    if not text:
+        return None
+    try:
+        dt = parsedate_to_datetime(text)
+    except (TypeError, ValueError, IndexError):
+        try:
+            dt = datetime.fromisoformat(text.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.utctimetuple()
+
+
+def _item_episode(elem):
+    """從 <item>（RSS）或 <entry>（Atom）取出 (發佈時間, (title, link, mp3_url))；沒有音訊時回傳 None。
+
+    只看與項目同一命名空間的子元素，itunes:title 等擴充欄位不會蓋掉標題。
+    """
+    ns = elem.tag[: elem.tag.rfind("}") + 1]
+    title = link = mp3_url = published = None
+    for child in elem:
+        tag = child.tag
+        if not isinstance(tag, str) or not tag.startswith(ns) or "}" in tag[len(ns):]:
+            continue
+        name = tag[len(ns):]
+        if name == "title" and title is None:
+            title = (child.text or "").strip()
+        elif name == "enclosure" and mp3_url is None:
+            url = (child.get("url") or "").strip()
+            if url and _is_audio(child.get("type"), url):
+                mp3_url = url
+        elif name == "link":
+            href = child.get("href")
+            if href is None:
+                link = link or (child.text or "").strip()
+            elif mp3_url is None and _is_audio(child.get("type"), href):
+                mp3_url = href
+            elif child.get("rel", "alternate") == "alternate" and not link:
+                link = href
+        elif name in ("pubDate", "published") and published is None:
+            published = _parse_item_date(child.text)
+    if not mp3_url:
+        return None
+    return published, (title or "", link or "", mp3_url)
+
+
+def _finish_feed_stream(stream, content_hash, feed=None):
+    """記錄解析耗時與讀取量，並以內容雜湊判斷是否有變：回傳 (episodes, content_hash)，未變時 episodes 為 None。"""
+    feed = _feed_label(feed)
+    observe_stage("parse", stream.parse_seconds, feed=feed)
+    METRICS.inc("rasrss_feed_bytes_total", stream.bytes_read, feed=feed)
+    if stream.stopped:
+        # 沒讀完整份內容，保留舊的雜湊
+        _count_feed_fetch("partial")
+        return stream.episodes(), content_hash
+    new_hash = stream.content_hash
+    if content_hash and new_hash == content_hash:
+        _count_feed_fetch("hit")
+        return None, new_hash
+    _count_feed_fetch("miss")
+    return stream.episodes(), new_hash
+
+
+def fetch_feed(rss_url, etag=None, last_modified=None, content_hash=None, is_known=None, depth=None, stream=None):
+    """條件式 GET 並邊讀邊解析 RSS：帶 If-None-Match / If-Modified-Since，未變更時不解析。
+
+    回傳 (episodes, etag, last_modified, content_hash)；episodes 由舊到新，304 或內容雜湊相同時為 None。
+    is_known / depth 見 FeedStream，讀到已處理的集數或足夠的集數就停止下載；
+    需要頻道標題等其他資訊時可傳入自己的 FeedStream（此時忽略 is_known / depth）。
+    """
+    started = time.monotonic()
+    stream = stream or FeedStream(is_known, depth)
+    with HTTP.get(rss_url, headers=_conditional_headers(etag, last_modified), timeout=POLL_FEED_TIMEOUT, stream=True) as resp:
+        if resp.status_code == 304:
+            observe_stage("rss_fetch", time.monotonic() - started)
+            _count_feed_fetch("not_modified")
+            return None, etag, last_modified, content_hash
+        resp.raise_for_status()
+        for chunk in resp.iter_content(FEED_CHUNK_BYTES):
+            if stream.feed(chunk):
+                break
+        else:
+            stream.close()
+    # 讀取與解析交錯進行，網路時間扣掉解析時間
+    observe_stage("rss_fetch", time.monotonic() - started - stream.parse_seconds)
+    episodes, new_hash = _finish_feed_stream(stream, content_hash)
+    return episodes, resp.headers.get("ETag"), resp.headers.get("Last-Modified"), new_hash
+
 
+def _save_feed_validators(feed_id, etag, last_modified, content_hash):
+    """記錄條件式 GET 的驗證資訊；僅在本次內容已處理完畢後呼叫，失敗時保留舊值以便重試。"""
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE feeds SET etag = ?, last_modified = ?, content_hash = ? WHERE id = ?",
+            (etag, last_modified, content_hash, feed_id),
+        )
+
+
+def get_feed_title(rss_url):
+    """從 RSS 取得頻道標題（不是集數標題）；讀到最新一則後即停止讀取，沒有標題時回傳 None。"""
+    stream = FeedStream(depth=1)
+    fetch_feed(rss_url, stream=stream)
+    return stream.title
 
-def get_latest_mp3_from_rss(rss_url):
-    """從 RSS 取得最新一則的 MP3 連結。"""
-    resp = requests.get(rss_url, timeout=30)
-    resp.raise_for_status()
-    feed = feedparser.parse(resp.content)
-    if not feed.entries:
-        return None, None, None
-    entry = feed.entries[0]
-    title = entry.get("title", "")
-    link = entry.get("link", "")
-    mp3_url = None
+
+def _entry_mp3_url(entry):
+    """從單一 RSS 項目的 enclosure 或 links 找出音訊連結。"""
     if hasattr(entry, "enclosures"):
         for enc in entry.enclosures:
             href = getattr(enc, "href", "") or enc.get("href", "")
-            if "audio" in enc.get("type", "") or "mpeg" in enc.get("type", "") or href.lower().endswith(".mp3"):
-                mp3_url = href
-                break
-    if not mp3_url and entry.get("links"):
+            if _is_audio(enc.get("type"), href):
+                return href
+    if entry.get("links"):
         for link_obj in entry.links:
-            t = (link_obj.get("type") or "").lower()
             h = link_obj.get("href", "")
-            if "audio" in t or "mpeg" in t or h.lower().endswith(".mp3"):
-                mp3_url = h
-                break
-    return title, link, mp3_url
+            if _is_audio(link_obj.get("type"), h):
+                return h
+    return None
+
+
+def _feed_items(feed):
+    """feedparser 解析結果中含 MP3 的項目，文件順序：[(發佈時間, (title, link, mp3_url)), ...]。"""
+    items = []
+    for entry in feed.entries:
+        mp3_url = _entry_mp3_url(entry)
+        if mp3_url:
+            items.append((entry.get("published_parsed"), (entry.get("title", ""), entry.get("link", ""), mp3_url)))
+    return items
+
+
+def _order_episodes(items):
+    """全部項目都有發佈時間時依時間排序，否則視為 RSS 慣例的新到舊並反轉；回傳由舊到新的集數。"""
+    if items and all(published for published, _ in items):
+        items.sort(key=lambda item: tuple(item[0]))
+    else:
+        items.reverse()
+    return [episode for _, episode in items]
+
+
+def unseen_episodes(feed_id, episodes):
+    """以一次集合查詢比對 episode_done，回傳尚未處理的項目（保持原順序）。"""
+    if not episodes:
+        return []
+    urls = [mp3_url for _, _, mp3_url in episodes]
+    rows = get_db().execute(
+        f"SELECT mp3_url FROM episode_done WHERE feed_id = ? AND mp3_url IN ({', '.join('?' * len(urls))})",
+        (feed_id, *urls),
+    ).fetchall()
+    done = {r["mp3_url"] for r in rows}
+    return [ep for ep in episodes if ep[2] not in done]
 
 
 def already_processed(feed_id, mp3_url):
-    conn = get_db()
-    row = conn.execute(
+    row = get_db().execute(
         "SELECT 1 FROM episode_done WHERE feed_id = ? AND mp3_url = ?",
         (feed_id, mp3_url),
     ).fetchone()
-    conn.close()
     return row is not None
 
 
 def mark_processed(feed_id, mp3_url):
-    conn = get_db()
-    conn.execute(
-        "INSERT OR IGNORE INTO episode_done (feed_id, mp3_url) VALUES (?, ?)",
-        (feed_id, mp3_url),
-    )
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute(
+            "INSERT OR IGNORE INTO episode_done (feed_id, mp3_url) VALUES (?, ?)",
+            (feed_id, mp3_url),
+        )
+
+
+# 設定快取：第一次讀取時一次載入整張 settings 表，寫入後失效；以資料庫路徑為鍵，換庫時自動重載。
+# 其他行程（API 與排程行程分開時）寫入的設定無法通知本行程，快取最多保留 SETTINGS_CACHE_SECONDS 秒
+SETTINGS_CACHE_SECONDS = 5
+_settings_cache = None
+_settings_lock = threading.Lock()
+
+
+def _load_settings():
+    global _settings_cache
+    with _settings_lock:
+        cache = _settings_cache
+        if cache is None or cache[0] != DATABASE or time.monotonic() - cache[1] > SETTINGS_CACHE_SECONDS:
+            rows = get_db().execute("SELECT key, value FROM settings").fetchall()
+            cache = (DATABASE, time.monotonic(), {row["key"]: row["value"] for row in rows})
+            _settings_cache = cache
+        return cache[2]
+
+
+def _invalidate_settings():
+    global _settings_cache
+    with _settings_lock:
+        _settings_cache = None
 
 
 def _get_setting(key):
-    conn = get_db()
-    row = conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
-    conn.close()
-    return row["value"] if row else None
+    return _load_settings().get(key)
 
 
-def _set_setting(key, value):
-    conn = get_db()
-    conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value or ""))
-    conn.commit()
-    conn.close()
+def _set_settings(values):
+    """一次寫入多個設定（單一交易），並讓快取失效。"""
+    with transaction() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+            [(key, value or "") for key, value in values.items()],
+        )
+    _invalidate_settings()
+
+
+class ModelCallError(Exception):
+    """模型呼叫失敗，附帶 HTTP 狀態碼與 Retry-After（若有）供熔斷器判斷。"""
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.code = status
+        self.retry_after = retry_after
+
+
+def _error_status(exc):
+    """取出例外的 HTTP 狀態碼（google.api_core 例外與 ModelCallError 皆有 code）。"""
+    code = getattr(exc, "code", None)
+    return code if isinstance(code, int) else None
+
+
+class ModelHealth:
+    """各模型的健康狀態與熔斷器，讓每次呼叫直接從最近成功的模型開始。
+
+    closed（正常）→ 404 / 429 / 5xx / 逾時等失敗後 open（冷卻中，跳過）→ 冷卻結束 half_open
+    → 允許一次試探，成功回 closed、失敗再 open 且冷卻時間加倍。其他 4xx（如 key 錯誤）不視為模型故障。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}  # (provider, model) -> 狀態 dict
+        self._last_good = {}  # provider -> model
+
+    def _entry(self, provider, model):
+        key = (provider, model)
+        if key not in self._models:
+            self._models[key] = {
+                "calls": 0,
+                "failures": 0,
+                "consecutive_failures": 0,
+                "latency_total": 0.0,
+                "successes": 0,
+                "last_latency": None,
+                "last_status": None,
+                "last_error": None,
+                "open_until": 0.0,
+            }
+        return self._models[key]
+
+    def _state(self, entry, now):
+        if entry["open_until"] > now:
+            return "open"
+        return "half_open" if entry["consecutive_failures"] else "closed"
+
+    def order(self, provider, models):
+        """本次要嘗試的模型順序：比最近成功者優先的半開模型（試探）→ 最近成功者 → 其餘正常 / 半開模型。"""
+        now = time.time()
+        with self._lock:
+            last_good = self._last_good.get(provider)
+            states = {m: self._state(self._entry(provider, m), now) for m in models}
+            good_rank = models.index(last_good) if last_good in models else len(models)
+            probes = [m for m in models[:good_rank] if states[m] == "half_open"]
+            rest = [m for m in models if m not in probes and m != last_good and states[m] != "open"]
+            head = [last_good] if last_good in models and states[last_good] != "open" else []
+            ordered = probes + head + rest
+            # 半開模型同一時間只讓一個呼叫試探，其他呼叫在試探期間視為 open
+            for m in ordered:
+                if states[m] == "half_open":
+                    self._models[(provider, m)]["open_until"] = now + MODEL_PROBE_SECONDS
+            return ordered
+
+    def record_success(self, provider, model, latency):
+        with self._lock:
+            entry = self._entry(provider, model)
+            entry["calls"] += 1
+            entry["successes"] += 1
+            entry["latency_total"] += latency
+            entry["last_latency"] = latency
+            entry["last_status"] = 200
+            entry["consecutive_failures"] = 0
+            entry["open_until"] = 0.0
+            self._last_good[provider] = model
+
+    def record_failure(self, provider, model, latency, exc):
+        status = _error_status(exc)
+        with self._lock:
+            entry = self._entry(provider, model)
+            entry["calls"] += 1
+            entry["failures"] += 1
+            entry["last_latency"] = latency
+            entry["last_status"] = status
+            entry["last_error"] = str(exc)[:200]
+            if status is not None and 400 <= status < 500 and status not in (404, 429):
+                entry["open_until"] = 0.0
+                return
+            entry["consecutive_failures"] += 1
+            if status == 404:
+                cooldown = MODEL_COOLDOWN_NOT_FOUND
+            else:
+                base = MODEL_COOLDOWN_RATE_LIMIT if status == 429 else MODEL_COOLDOWN_ERROR
+                cooldown = min(base * 2 ** (entry["consecutive_failures"] - 1), MODEL_COOLDOWN_MAX)
+                retry_after = getattr(exc, "retry_after", None)
+                if retry_after:
+                    cooldown = max(cooldown, retry_after)
+            entry["open_until"] = time.time() + cooldown
+            if self._last_good.get(provider) == model:
+                self._last_good.pop(provider)
+
+    def rate_limited_for(self, provider, models):
+        """所有模型都因 429 冷卻中時回傳最快恢復的秒數；有模型是因其他錯誤冷卻則回傳 None。"""
+        now = time.time()
+        with self._lock:
+            entries = [self._entry(provider, m) for m in models]
+            if not entries or any(e["last_status"] != 429 for e in entries):
+                return None
+            return max(0.0, min(e["open_until"] for e in entries) - now)
+
+    def snapshot(self):
+        now = time.time()
+        with self._lock:
+            out = []
+            for (provider, model), e in self._models.items():
+                out.append({
+                    "provider": provider,
+                    "model": model,
+                    "state": self._state(e, now),
+                    "last_good": self._last_good.get(provider) == model,
+                    "calls": e["calls"],
+                    "error_rate": round(e["failures"] / e["calls"], 3) if e["calls"] else None,
+                    "avg_latency": round(e["latency_total"] / e["successes"], 3) if e["successes"] else None,
+                    "last_latency": round(e["last_latency"], 3) if e["last_latency"] is not None else None,
+                    "last_status": e["last_status"],
+                    "last_error": e["last_error"],
+                    "cooldown_seconds": max(0, round(e["open_until"] - now)),
+                })
+            return out
 
 
-def call_gemini(api_key, prompt):
-    """AI Studio Gemini：優先 3.0 Flash 相關，再 2.5、2.0。"""
-    try:
-        import google.generativeai as genai
-    except ImportError:
-        raise RuntimeError("請安裝：pip install google-generativeai")
-    genai.configure(api_key=api_key)
+MODEL_HEALTH = ModelHealth()
+
+
+class QuotaExceeded(Exception):
+    """AI 配額暫時用盡：工作延後 retry_after 秒再執行，不視為失敗。"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# 429 錯誤訊息中表示每日額度用盡的字樣（Gemini：...PerDay...、OpenRouter：free-models-per-day）
+_DAILY_LIMIT_RE = re.compile(r"per[\s_-]?day|daily", re.IGNORECASE)
+
+
+def _utc_day():
+    return datetime.utcnow().strftime("%Y-%m-%d")
+
+
+def _seconds_until_utc_midnight():
+    now = datetime.utcnow()
+    return (datetime.combine(now.date() + timedelta(days=1), datetime.min.time()) - now).total_seconds()
+
+
+class QuotaLimiter:
+    """各 provider / 模型的呼叫配額：每分鐘 token bucket + 每日請求數（寫入 model_usage，每 QUOTA_REFRESH_SECONDS 秒
+    由資料庫重新讀取當日合計，其他行程的用量也會計入；已扣額度但尚未 record 的呼叫另外累計）。
+
+    呼叫前 acquire 依偏好順序挑第一個還有額度的模型並扣額度，呼叫後 record 記下用量；遇到 429 時 block 該模型
+    （每日額度用盡時到 UTC 午夜，否則依 Retry-After），同一波工作就不會接連打到已被限流的模型。
+    """
+
+    def __init__(self, quotas):
+        self._quotas = quotas
+        self._lock = threading.Lock()
+        self._buckets = {}  # (provider, model) -> [剩餘 tokens, 上次補充的 monotonic 時間]
+        self._blocked = {}  # (provider, model) -> 此 time.time() 之前不呼叫
+        self._day = None
+        self._loaded_at = 0.0  # 上次讀取資料庫的 monotonic 時間
+        self._daily = {}  # (provider, model) -> 資料庫中的當日請求數；model 為 None 是 provider 合計
+        self._pending = {}  # (provider, model) -> 本行程已扣額度、尚未寫入資料庫的請求數
+
+    def _limits(self, key):
+        provider, model = key
+        if model is None:
+            return self._quotas.get(key)
+        return self._quotas.get(key) or self._quotas.get((provider, "*"))
+
+    def _refresh(self):
+        """換日或快取超過 QUOTA_REFRESH_SECONDS 秒時重新讀取資料庫中的當日請求數。須持有 self._lock。"""
+        day = _utc_day()
+        if day == self._day and time.monotonic() - self._loaded_at < QUOTA_REFRESH_SECONDS:
+            return
+        rows = get_db().execute(
+            "SELECT provider, model, SUM(requests) AS n FROM model_usage WHERE day = ? GROUP BY provider, model", (day,)
+        ).fetchall()
+        self._daily = {}
+        for row in rows:
+            self._daily[(row["provider"], row["model"])] = row["n"]
+            total = (row["provider"], None)
+            self._daily[total] = self._daily.get(total, 0) + row["n"]
+        self._day = day
+        self._loaded_at = time.monotonic()
+
+    def _used(self, key):
+        return self._daily.get(key, 0) + self._pending.get(key, 0)
+
+    def _wait(self, key, now):
+        """key 還要等幾秒才有額度（0 = 現在就有），順便補充 token bucket。"""
+        per_minute, per_day = self._limits(key) or (0, 0)
+        wait = max(0.0, self._blocked.get(key, 0) - time.time())
+        if per_day and self._used(key) >= per_day:
+            wait = max(wait, _seconds_until_utc_midnight())
+        if per_minute:
+            bucket = self._buckets.setdefault(key, [float(per_minute), now])
+            bucket[0] = min(per_minute, bucket[0] + (now - bucket[1]) * per_minute / 60)
+            bucket[1] = now
+            if bucket[0] < 1:
+                wait = max(wait, (1 - bucket[0]) * 60 / per_minute)
+        return wait
+
+    def _model_wait(self, provider, model, now):
+        return max(self._wait((provider, model), now), self._wait((provider, None), now))
+
+    def check(self, provider, models, label):
+        """所有模型在 QUOTA_MAX_WAIT 秒內都不會有額度時拋出 QuotaExceeded（不扣額度），供下載音訊前先行判斷。"""
+        with self._lock:
+            self._refresh()
+            now = time.monotonic()
+            wait = min((self._model_wait(provider, m, now) for m in models), default=0.0)
+        if wait > QUOTA_MAX_WAIT:
+            raise QuotaExceeded(f"{label} 配額已用盡，約 {round(wait)} 秒後再試", wait)
+
+    def acquire(self, provider, models, label):
+        """挑第一個現在就有額度的模型並扣一次額度；都要等待時，QUOTA_MAX_WAIT 秒內可恢復就等，否則拋出 QuotaExceeded。"""
+        while True:
+            with self._lock:
+                self._refresh()
+                now = time.monotonic()
+                waits = []
+                for model in models:
+                    wait = self._model_wait(provider, model, now)
+                    if wait > 0:
+                        waits.append(wait)
+                        continue
+                    for key in ((provider, model), (provider, None)):
+                        if key in self._buckets:
+                            self._buckets[key][0] -= 1
+                        self._pending[key] = self._pending.get(key, 0) + 1
+                    return model
+            wait = min(waits)
+            if wait > QUOTA_MAX_WAIT:
+                raise QuotaExceeded(f"{label} 配額已用盡，約 {round(wait)} 秒後再試", wait)
+            started = time.monotonic()
+            time.sleep(wait)
+            observe_stage("quota_wait", time.monotonic() - started)
+
+    def block(self, provider, model, exc):
+        """模型回應 429：每日額度用盡時停用到 UTC 午夜（有 provider 共用額度時停用整個 provider），否則依 Retry-After。"""
+        if _DAILY_LIMIT_RE.search(str(exc)):
+            key = (provider, None) if (provider, None) in self._quotas else (provider, model)
+            seconds = _seconds_until_utc_midnight()
+        else:
+            key = (provider, model)
+            seconds = getattr(exc, "retry_after", None) or QUOTA_DEFER_MIN
+        with self._lock:
+            self._blocked[key] = max(self._blocked.get(key, 0), time.time() + seconds)
+
+    def retry_after(self, provider, models):
+        """最快有模型恢復額度的秒數。"""
+        with self._lock:
+            now = time.monotonic()
+            return min((self._model_wait(provider, m, now) for m in models), default=0.0)
+
+    def limits(self, provider, models):
+        """有設定額度的 (model, 每分鐘, 每日)；model 為 None 是 provider 共用額度。"""
+        rows = [(m, *self._limits((provider, m))) for m in models if self._limits((provider, m))]
+        if self._limits((provider, None)):
+            rows.append((None, *self._limits((provider, None))))
+        return rows
+
+    def record(self, provider, model, feed_id, rate_limited=False, tokens=(0, 0), audio_seconds=0):
+        """把一次呼叫（含失敗）累加到當日用量。"""
+        input_tokens, output_tokens = tokens
+        with transaction() as conn:
+            conn.execute(
+                """
+                INSERT INTO model_usage
+                    (day, provider, model, feed_id, requests, rate_limited, input_tokens, output_tokens, audio_seconds)
+                VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?)
+                ON CONFLICT (day, provider, model, feed_id) DO UPDATE SET
+                    requests = requests + 1,
+                    rate_limited = rate_limited + excluded.rate_limited,
+                    input_tokens = input_tokens + excluded.input_tokens,
+                    output_tokens = output_tokens + excluded.output_tokens,
+                    audio_seconds = audio_seconds + excluded.audio_seconds
+                """,
+                (_utc_day(), provider, model, feed_id or 0, int(rate_limited), input_tokens, output_tokens, audio_seconds),
+            )
+        with self._lock:
+            # 已寫入資料庫：從未寫入的計數移到當日合計（下次重新讀取時也會包含這一次）
+            for key in ((provider, model), (provider, None)):
+                if self._pending.get(key):
+                    self._pending[key] -= 1
+                self._daily[key] = self._daily.get(key, 0) + 1
+        if input_tokens:
+            METRICS.inc("rasrss_model_tokens_total", input_tokens, provider=provider, model=model, kind="input")
+        if output_tokens:
+            METRICS.inc("rasrss_model_tokens_total", output_tokens, provider=provider, model=model, kind="output")
+
+
+QUOTAS = QuotaLimiter(MODEL_QUOTAS)
+
+
+def call_with_fallback(provider, models, fn, label, audio_seconds=0):
+    """依 MODEL_HEALTH 排序、在 QUOTAS 額度內逐一呼叫 fn(model)，記錄延遲、錯誤與用量；回傳 (結果, 模型名稱)。
+
+    fn 回傳 (結果, (input tokens, output tokens))；audio_seconds 為本次送出的音訊長度，記入用量。
+    所有模型都沒有額度或都回應 429 時拋出 QuotaExceeded，由工作佇列延後執行。
+    """
     last_err = None
-    for model_name in GEMINI_MODEL_PRIORITY:
+    candidates = MODEL_HEALTH.order(provider, models)
+    if not candidates:
+        cooldown = MODEL_HEALTH.rate_limited_for(provider, models)
+        if cooldown is not None:
+            raise QuotaExceeded(f"{label} 所有模型皆因 429 冷卻中，約 {round(cooldown)} 秒後再試", cooldown)
+        raise RuntimeError(f"{label} 所有模型皆在冷卻中，請稍後再試")
+    job = JOBS.current()
+    feed_id = job.feed_id if job is not None else None
+    rate_limited = 0
+    attempts = 0
+    while candidates:
+        model = QUOTAS.acquire(provider, candidates, label)
+        candidates.remove(model)
+        attempts += 1
+        started = time.monotonic()
         try:
-            model = genai.GenerativeModel(model_name)
-            r = model.generate_content(prompt)
-            return (r.text or "").strip(), model_name
+            result, tokens = fn(model)
         except Exception as e:
+            MODEL_HEALTH.record_failure(provider, model, time.monotonic() - started, e)
+            limited = _error_status(e) == 429
+            if limited:
+                QUOTAS.block(provider, model, e)
+                rate_limited += 1
+            QUOTAS.record(provider, model, feed_id, rate_limited=limited)
+            METRICS.inc("rasrss_retries_total", stage="model")
             last_err = e
             continue
-    raise RuntimeError(f"Gemini 無可用模型：{last_err}")
+        MODEL_HEALTH.record_success(provider, model, time.monotonic() - started)
+        QUOTAS.record(provider, model, feed_id, tokens=tokens, audio_seconds=audio_seconds)
+        return result, model
+    if rate_limited == attempts:
+        retry_after = max(QUOTAS.retry_after(provider, models), QUOTA_DEFER_MIN)
+        raise QuotaExceeded(f"{label} 所有模型皆回應 429：{last_err}", retry_after)
+    raise RuntimeError(f"{label} 無可用模型：{last_err}")
+
+
+_gemini_configured_key = None
+_gemini_configure_lock = threading.Lock()
+
+
+def _configure_gemini(api_key):
+    """回傳已設定好 key 的 genai 模組；只有 key 變更時才重新 configure。"""
+    global _gemini_configured_key
+    try:
+        import google.generativeai as genai
+    except ImportError:
+        raise RuntimeError("請安裝：pip install google-generativeai")
+    with _gemini_configure_lock:
+        if api_key != _gemini_configured_key:
+            genai.configure(api_key=api_key)
+            _gemini_configured_key = api_key
+    return genai
+
+
+def _gemini_tokens(response):
+    """Gemini 回應的 (input tokens, output tokens)；SDK 未附 usage_metadata 時為 0。"""
+    usage = getattr(response, "usage_metadata", None)
+    return (
+        getattr(usage, "prompt_token_count", 0) or 0,
+        getattr(usage, "candidates_token_count", 0) or 0,
+    )
+
+
+def call_gemini(api_key, prompt):
+    """AI Studio Gemini：優先 3.0 Flash 相關，再 2.5、2.0。"""
+    genai = _configure_gemini(api_key)
+
+    def generate(model_name):
+        r = genai.GenerativeModel(model_name).generate_content(prompt)
+        return (r.text or "").strip(), _gemini_tokens(r)
+
+    return call_with_fallback("gemini", GEMINI_MODEL_PRIORITY, generate, "Gemini")
 
 
 def call_openrouter(api_key, prompt):
@@ -200,29 +1435,33 @@ def call_openrouter(api_key, prompt):
         "HTTP-Referer": "http://localhost:5001",
         "X-Title": "rasrss",
     }
-    last_err = None
-    for model in OPENROUTER_FREE_MODELS:
-        try:
-            r = requests.post(
-                OPENROUTER_API_URL,
-                headers=headers,
-                json={
-                    "model": model,
-                    "messages": [{"role": "user", "content": prompt}],
-                    "temperature": 0.7,
-                },
-                timeout=60,
-            )
-            if r.status_code == 200:
-                data = r.json()
-                if "choices" in data and data["choices"]:
-                    text = data["choices"][0].get("message", {}).get("content", "")
-                    return (text or "").strip(), model
-            last_err = r.text or str(r.status_code)
-        except Exception as e:
-            last_err = str(e)
-            continue
-    raise RuntimeError(f"OpenRouter 無可用模型：{last_err}")
+
+    def complete(model):
+        r = HTTP.post(
+            OPENROUTER_API_URL,
+            headers=headers,
+            json={
+                "model": model,
+                "messages": [{"role": "user", "content": prompt}],
+                "temperature": 0.7,
+            },
+            timeout=60,
+        )
+        if r.status_code == 200:
+            data = r.json()
+            if "choices" in data and data["choices"]:
+                text = data["choices"][0].get("message", {}).get("content", "")
+                usage = data.get("usage") or {}
+                return (text or "").strip(), (usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0)
+            raise ModelCallError(r.text or "回應沒有 choices")
+        retry_after = r.headers.get("Retry-After", "")
+        raise ModelCallError(
+            r.text or str(r.status_code),
+            status=r.status_code,
+            retry_after=int(retry_after) if retry_after.isdigit() else None,
+        )
+
+    return call_with_fallback("openrouter", OPENROUTER_FREE_MODELS, complete, "OpenRouter")
 
 
 def _get_gemini_key():
@@ -233,59 +1472,553 @@ def _get_gemini_key():
     return key or None
 
 
-def _download_mp3(mp3_url):
-    """下載 MP3 到暫存檔，回傳路徑。呼叫方須負責刪除。"""
-    r = requests.get(mp3_url, timeout=120, stream=True)
-    r.raise_for_status()
-    tmpdir = os.environ.get("TMPDIR", os.environ.get("TEMP", "/tmp"))
-    path = os.path.join(tmpdir, f"rasrss_{os.getpid()}_{time.time():.0f}.mp3")
-    with open(path, "wb") as f:
-        for chunk in r.iter_content(chunk_size=65536):
-            if chunk:
-                f.write(chunk)
-    return path
+class _RangeNotSupported(Exception):
+    """伺服器未以 206 回應 Range 請求，改用單一連線下載。"""
+
+
+def _audio_buffer(size):
+    """已知大小且不超過門檻時放記憶體，否則（含大小未知）用匿名暫存檔（關閉即刪除）。
+
+    不可改用 tempfile.SpooledTemporaryFile：Python 3.10 上它不是 io.IOBase，
+    genai.upload_file 只接受 IOBase 的檔案物件，其餘當成路徑 os.fspath() 而拋出 TypeError。
+    """
+    if size is not None and size <= AUDIO_SPOOL_MAX_BYTES:
+        return io.BytesIO()
+    return tempfile.TemporaryFile()
+
 
+def probe_audio(mp3_url):
+    """以一次 HEAD（跟隨轉址）取得最終網址、大小、ETag 與是否支援 Range，供音訊指紋與下載共用；失敗回傳 None。"""
+    try:
+        r = HTTP.head(mp3_url, allow_redirects=True, timeout=30)
+    except requests.RequestException:
+        return None
+    if not r.ok:
+        return None
+    length = r.headers.get("Content-Length", "")
+    return {
+        "url": r.url,
+        "length": int(length) if length.isdigit() and int(length) > 0 else None,
+        "etag": r.headers.get("ETag", "").strip(),
+        "ranges": r.headers.get("Accept-Ranges", "").lower() == "bytes",
+    }
+
+
+def _download_stream(mp3_url, started):
+    """單一連線串流下載，回傳 (buffer, ttfb 秒數)。"""
+    with HTTP.get(mp3_url, timeout=120, stream=True) as r:
+        r.raise_for_status()
+        length = r.headers.get("Content-Length")
+        buf = _audio_buffer(int(length) if length and length.isdigit() else None)
+        ttfb = None
+        try:
+            for chunk in r.iter_content(chunk_size=65536):
+                if chunk:
+                    if ttfb is None:
+                        ttfb = time.monotonic() - started
+                    buf.write(chunk)
+        except Exception:
+            buf.close()
+            raise
+    return buf, ttfb
+
+
+def _download_ranges(url, size, started):
+    """以多條 Range 連線平行下載，各段直接寫入 buffer 的對應位置，回傳 (buffer, ttfb 秒數)。"""
+    part_size = -(-size // DOWNLOAD_PARTS)
+    ranges = [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+    buf = _audio_buffer(size)
+    lock = threading.Lock()
+    first_bytes = []
+
+    def fetch(byte_range):
+        start, end = byte_range
+        with HTTP.get(url, headers={"Range": f"bytes={start}-{end}"}, timeout=120, stream=True) as r:
+            r.raise_for_status()
+            if r.status_code != 206:
+                raise _RangeNotSupported(r.status_code)
+            pos = start
+            for chunk in r.iter_content(chunk_size=65536):
+                if not chunk:
+                    continue
+                with lock:
+                    if len(first_bytes) == 0:
+                        first_bytes.append(time.monotonic() - started)
+                    buf.seek(pos)
+                    buf.write(chunk)
+                pos += len(chunk)
+        if pos != end + 1:
+            raise RuntimeError(f"分段下載不完整：bytes={start}-{end}，實得 {pos - start}")
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+            list(pool.map(fetch, ranges))
+    except Exception:
+        buf.close()
+        raise
+    buf.seek(0, io.SEEK_END)
+    return buf, (first_bytes[0] if first_bytes else None)
+
+
+def download_audio(mp3_url, probe=None):
+    """下載音訊到記憶體（超過門檻或大小未知時落地為匿名暫存檔），不留下任何 /tmp 路徑。
+
+    伺服器支援 Range 且檔案夠大時平行分段下載；probe 為 probe_audio 的結果（已取得時傳入，省一次 HEAD）。
+    下載量、耗時、bytes/s 與 TTFB 記入目前工作。回傳已 seek 到開頭的 buffer，呼叫方須負責 close()。
+    """
+    started = time.monotonic()
+    parts = 1
+    if probe is None and DOWNLOAD_PARTS > 1:
+        probe = probe_audio(mp3_url)
+    buf = None
+    if DOWNLOAD_PARTS > 1 and probe and probe["ranges"] and (probe["length"] or 0) >= RANGE_MIN_BYTES:
+        try:
+            buf, ttfb = _download_ranges(probe["url"], probe["length"], started)
+            parts = DOWNLOAD_PARTS
+        except _RangeNotSupported:
+            buf = None
+    if buf is None:
+        buf, ttfb = _download_stream(mp3_url, started)
+    elapsed = time.monotonic() - started
+    observe_stage("download", elapsed)
+    total = buf.tell()
+    buf.seek(0)
+    record_job_metrics(
+        download_bytes=total,
+        download_seconds=round(elapsed, 3),
+        download_bytes_per_sec=round(total / elapsed) if elapsed > 0 else None,
+        download_ttfb_seconds=round(ttfb, 3) if ttfb is not None else None,
+        download_parts=parts,
+    )
+    return buf
+
+
+def _ignored_audio_param(name):
+    name = name.lower()
+    return any(
+        name.startswith(p[:-1]) if p.endswith("*") else name == p for p in AUDIO_URL_IGNORED_PARAMS
+    )
+
+
+def _normalize_audio_url(url):
+    """指紋用網址：小寫 host（保留非預設 port）、路徑與排序後的查詢參數；只去掉已知的簽章 / 追蹤參數與 fragment。"""
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port not in (80, 443):
+        host += f":{parts.port}"
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if not _ignored_audio_param(k))
+    return host + parts.path + ("?" + urlencode(query) if query else "")
+
+
+def _audio_range_hash(url, start, end):
+    """音訊 [start, end] bytes 的 SHA-256。開頭（start 為 0）在伺服器忽略 Range 時讀到足夠長度即中斷；
+    其他位置須回應 206，否則回傳 None。"""
+    digest = hashlib.sha256()
+    remaining = end - start + 1
+    try:
+        with HTTP.get(url, headers={"Range": f"bytes={start}-{end}"}, stream=True, timeout=30) as r:
+            if r.status_code != 206 and not (start == 0 and r.status_code == 200):
+                return None
+            for chunk in r.iter_content(chunk_size=16 * 1024):
+                digest.update(chunk[:remaining])
+                remaining -= len(chunk)
+                if remaining <= 0:
+                    break
+    except requests.RequestException:
+        return None
+    return digest.hexdigest()
+
+
+def audio_fingerprints(probe):
+    """由 probe_audio 的結果（最終網址、大小與 ETag）組出內容指紋清單；probe 為 None 時回傳空清單。
+
+    種類：etag（強 ETag）、url（正規化網址 + 大小）、head（開頭雜湊 + 大小）、content（開頭與結尾雜湊 + 大小）。
+    比對規則見 find_cached_transcript。
+    """
+    if probe is None:
+        return []
+    length = probe["length"]
+    etag = probe["etag"]
+    keys = []
+    if etag and not etag.startswith("W/"):
+        keys.append(f"etag:{(urlsplit(probe['url']).hostname or '').lower()}:{etag}")
+    if length:
+        keys.append(f"url:{_normalize_audio_url(probe['url'])}:{length}")
+        n = FINGERPRINT_HEAD_BYTES
+        head = _audio_range_hash(probe["url"], 0, n - 1) if n > 0 else None
+        if head:
+            keys.append(f"head:{head}:{length}")
+            # 不超過 n bytes 的檔案，開頭雜湊即整份內容
+            tail = _audio_range_hash(probe["url"], length - n, length - 1) if length > n else head
+            if tail:
+                content = hashlib.sha256(f"{head}:{tail}".encode()).hexdigest()
+                keys.append(f"content:{content}:{length}")
+    return keys
+
+
+def find_cached_transcript(feed_id, fingerprints):
+    """依指紋找出既有逐字稿，同一 feed 的優先、其次最早的一筆；沒有符合時回傳 None。
+
+    只有強 ETag 或內容指紋（開頭與結尾雜湊 + 大小）相符才沿用；只有開頭雜湊時須連正規化網址也相符。
+    單一的網址或開頭雜湊不算（同一路徑只差查詢參數、或同樣大小且片頭相同的不同集都會撞到）。
+    """
+    if not fingerprints:
+        return None
+    marks = ",".join("?" * len(fingerprints))
+    rows = get_db().execute(
+        f"""SELECT f.fingerprint, t.id, t.feed_id FROM audio_fingerprints f
+            JOIN transcripts t ON t.id = f.transcript_id
+            WHERE f.fingerprint IN ({marks})""",
+        fingerprints,
+    ).fetchall()
+    matched = {}  # transcript_id -> (feed_id, 相符的指紋種類)
+    for row in rows:
+        matched.setdefault(row["id"], (row["feed_id"], set()))[1].add(row["fingerprint"].split(":", 1)[0])
+    candidates = [
+        {"id": tid, "feed_id": fid}
+        for tid, (fid, kinds) in matched.items()
+        if "etag" in kinds or "content" in kinds or {"url", "head"} <= kinds
+    ]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda c: (c["feed_id"] != feed_id, c["id"]))
+
+
+def _save_fingerprints(conn, fingerprints, transcript_id, now):
+    conn.executemany(
+        "INSERT OR IGNORE INTO audio_fingerprints (fingerprint, transcript_id, created_at) VALUES (?, ?, ?)",
+        [(fp, transcript_id, now) for fp in fingerprints],
+    )
+
+
+_fingerprint_claims = {}
+_fingerprint_lock = threading.Lock()
+
+
+@contextmanager
+def _claim_fingerprints(fingerprints):
+    """同一份音訊同時只讓一個工作轉錄；其他工作等它結束後再查快取，避免幾秒內重複轉錄。"""
+    while True:
+        with _fingerprint_lock:
+            busy = next((_fingerprint_claims[fp] for fp in fingerprints if fp in _fingerprint_claims), None)
+            if busy is None:
+                done = threading.Event()
+                for fp in fingerprints:
+                    _fingerprint_claims[fp] = done
+                break
+        busy.wait()
+    try:
+        yield
+    finally:
+        with _fingerprint_lock:
+            for fp in fingerprints:
+                _fingerprint_claims.pop(fp, None)
+        done.set()
+
+
+def _backoff_delays(initial, maximum):
+    """指數退避的等待秒數序列，每次取 [delay/2, delay] 的隨機值避免多個工作同步輪詢。"""
+    delay = initial
+    while True:
+        yield random.uniform(delay / 2, delay)
+        delay = min(delay * 2, maximum)
+
+
+async def wait_file_active_async(genai, audio_file, timeout=FILE_ACTIVE_TIMEOUT):
+    """重新取得 Gemini 檔案狀態直到 ACTIVE（指數退避 + jitter），FAILED 或逾時則拋錯。"""
+    deadline = time.monotonic() + timeout
+    delays = _backoff_delays(FILE_POLL_INITIAL, FILE_POLL_MAX)
+    while True:
+        state = audio_file.state.name
+        if state == "ACTIVE":
+            return audio_file
+        if state == "FAILED":
+            raise RuntimeError(f"Gemini 檔案處理失敗：{audio_file.name}")
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"等待 Gemini 檔案處理逾時（{timeout} 秒）：{audio_file.name}")
+        await asyncio.sleep(min(next(delays), remaining))
+        audio_file = await asyncio.to_thread(genai.get_file, audio_file.name)
+
+
+def wait_files_active(genai, files, timeout=FILE_ACTIVE_TIMEOUT, return_exceptions=False):
+    """在同一條執行緒的 event loop 上同時等待多個上傳檔案變為 ACTIVE，回傳更新後的檔案。
+
+    return_exceptions=True 時個別檔案失敗或逾時不中斷其他檔案，該位置回傳例外物件。
+    """
+
+    async def wait_all():
+        return await asyncio.gather(
+            *(wait_file_active_async(genai, f, timeout) for f in files), return_exceptions=return_exceptions
+        )
 
-def transcribe_japanese_with_gemini(mp3_url):
-    """用 AI Studio Gemini 產生日文逐字稿：下載 MP3 → 上傳 Gemini → 完整一字不漏、不摘要。"""
+    return asyncio.run(wait_all())
+
+
+# MPEG Layer III 位元率（kbps）與取樣率表，用於在 frame 邊界切分 MP3
+_MP3_BITRATES = {
+    "mpeg1": [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    "mpeg2": [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+
+def _parse_mp3_header(b):
+    """解析 4 bytes 的 Layer III frame header，回傳 (bitrate_bps, frame_len)；不是合法 header 回傳 None。"""
+    if len(b) < 4 or b[0] != 0xFF or (b[1] & 0xE0) != 0xE0:
+        return None
+    version = (b[1] >> 3) & 0x3  # 3 = MPEG-1、2 = MPEG-2、0 = MPEG-2.5、1 = 保留
+    layer = (b[1] >> 1) & 0x3  # 1 = Layer III
+    bitrate_idx = b[2] >> 4
+    rate_idx = (b[2] >> 2) & 0x3
+    if version == 1 or layer != 1 or bitrate_idx in (0, 15) or rate_idx == 3:
+        return None
+    bitrate = _MP3_BITRATES["mpeg1" if version == 3 else "mpeg2"][bitrate_idx] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version][rate_idx]
+    padding = (b[2] >> 1) & 0x1
+    return bitrate, (144 if version == 3 else 72) * bitrate // sample_rate + padding
+
+
+def _find_mp3_frame(buf, pos, window=65536):
+    """從 pos 起找下一個 frame（連續兩個 header 皆合法才算），回傳 (offset, bitrate_bps) 或 None。"""
+    buf.seek(pos)
+    data = buf.read(window + 4)
+    for i in range(max(0, len(data) - 3)):
+        header = _parse_mp3_header(data[i:i + 4])
+        if not header:
+            continue
+        nxt = i + header[1]
+        if nxt + 4 > len(data) or _parse_mp3_header(data[nxt:nxt + 4]):
+            return pos + i, header[0]
+    return None
+
+
+def _mp3_stream_info(buf):
+    """(檔案大小, 第一個 frame 的位置, 位元率 bps)；無法辨識為 MP3 時回傳 None。"""
+    buf.seek(0, io.SEEK_END)
+    size = buf.tell()
+    buf.seek(0)
+    head = buf.read(10)
+    audio_start = 0
+    if head[:3] == b"ID3" and len(head) == 10:
+        # ID3v2 標籤大小為 syncsafe integer；flags 0x10 表示另有 10 bytes footer
+        audio_start = 10 + ((head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9])
+        if head[5] & 0x10:
+            audio_start += 10
+    first = _find_mp3_frame(buf, audio_start)
+    buf.seek(0)
+    if not first:
+        return None
+    return size, first[0], first[1]
+
+
+def mp3_duration(buf):
+    """依第一個 frame 的位元率估計 MP3 長度（秒）；無法辨識時回傳 0。"""
+    info = _mp3_stream_info(buf)
+    if not info:
+        return 0
+    size, first_offset, bitrate = info
+    return (size - first_offset) * 8 / bitrate
+
+
+def mp3_segments(buf, segment_seconds, overlap_seconds):
+    """依第一個 frame 的位元率把 MP3 切成彼此重疊的時間段，切點對齊 frame 邊界。
+
+    回傳 [(start_byte, end_byte), ...]；無法辨識為 MP3 時回傳 None。VBR 檔的時間點只是估計，靠重疊區補足。
+    """
+    info = _mp3_stream_info(buf)
+    if not info:
+        return None
+    size, first_offset, bitrate = info
+    bytes_per_sec = bitrate / 8
+    duration = (size - first_offset) / bytes_per_sec
+    segments = []
+    t = 0
+    while t < duration:
+        start = 0
+        if t > 0:
+            # 找不到 frame 同步時直接在估計位置切開（解碼端會自行重新同步），不可丟掉之後的音訊
+            raw = first_offset + int(t * bytes_per_sec)
+            found = _find_mp3_frame(buf, raw)
+            start = found[0] if found else raw
+        end = size
+        end_t = t + segment_seconds + overlap_seconds
+        if end_t < duration:
+            raw = first_offset + int(end_t * bytes_per_sec)
+            found = _find_mp3_frame(buf, raw)
+            end = min(found[0] if found else raw, size)
+        segments.append((start, end))
+        if end >= size:
+            break
+        t += segment_seconds
+    buf.seek(0)
+    return segments
+
+
+def _anchored_overlap(tail, head, window, min_match):
+    """在前段結尾 tail 與後段開頭 head 找錨定的重疊片段，回傳 (tail 中位置, head 中位置) 或 None。
+
+    片段之後的前段字數 + 片段之前的後段字數 + 片段長度即推算的重疊長度，須不超過 window 且片段佔一半以上；
+    最長片段不在錨定位置（例如常見的「と発表しました。」）時，真正的重疊只可能在它之後（前段）與之前（後段），縮小範圍再找。
+    """
+    matcher = difflib.SequenceMatcher(None, tail, head, autojunk=False)
+    alo, bhi = 0, len(head)
+    while True:
+        match = matcher.find_longest_match(alo, len(tail), 0, bhi)
+        if match.size < min_match:
+            return None
+        overlap = (len(tail) - match.a - match.size) + match.b + match.size
+        if overlap <= window and match.size >= overlap * STITCH_MIN_COVERAGE:
+            return match.a, match.b
+        alo, bhi = match.a + match.size, match.b
+
+
+def stitch_transcripts(texts, window=STITCH_WINDOW_CHARS, min_match=STITCH_MIN_MATCH_CHARS):
+    """依序接合各段逐字稿：前段結尾與後段開頭有錨定的相同片段時視為重疊區只保留一次，否則原文相接、不刪任何字。"""
+    result = ""
+    for text in texts:
+        text = (text or "").strip()
+        if not result:
+            result = text
+            continue
+        tail_start = max(0, len(result) - window)
+        found = _anchored_overlap(result[tail_start:], text[:window], window, min_match)
+        if found:
+            result = result[:tail_start + found[0]] + text[found[1]:]
+        else:
+            result = result + "\n" + text
+    return result
+
+
+def _generate_transcript(genai, audio_file, audio_seconds=0):
+    """依模型健康狀態（最近成功者優先）與配額嘗試 GEMINI_MODEL_PRIORITY 產生逐字稿。"""
+
+    def generate(model_name):
+        with stage_timer("generate", model_name):
+            response = genai.GenerativeModel(model_name).generate_content([audio_file, TRANSCRIBE_PROMPT])
+        if not response.text:
+            raise ModelCallError("模型回傳空白逐字稿")
+        return response.text.strip(), _gemini_tokens(response)
+
+    text, _ = call_with_fallback("gemini", GEMINI_MODEL_PRIORITY, generate, "Gemini", audio_seconds)
+    return text
+
+
+def _transcribe_settings():
+    """分段轉錄設定：(每段分鐘數，0 表示不分段；同時轉錄段數)。"""
+    try:
+        minutes = int(_get_setting("segment_minutes") or DEFAULT_SEGMENT_MINUTES)
+    except ValueError:
+        minutes = DEFAULT_SEGMENT_MINUTES
+    try:
+        parallelism = int(_get_setting("segment_parallelism") or DEFAULT_SEGMENT_PARALLELISM)
+    except ValueError:
+        parallelism = DEFAULT_SEGMENT_PARALLELISM
+    return max(0, min(minutes, MAX_SEGMENT_MINUTES)), max(1, min(parallelism, MAX_SEGMENT_PARALLELISM))
+
+
+def transcribe_segments(genai, audio, segments, parallelism, audio_seconds=0):
+    """分段轉錄：先平行上傳所有時間段，以單一 event loop 一次等待全部變為 ACTIVE，再平行轉錄，
+    最後依時間順序接合並去除重疊。失敗只重試該段（上傳或處理失敗的段重新上傳）；配額用盡則整集延後。
+
+    audio_seconds 為整集長度，依各段 bytes 比例換算送出的音訊秒數記入用量。
+    """
+    lock = threading.Lock()
+    job = JOBS.current()
+    audio.seek(0, io.SEEK_END)
+    seconds_per_byte = audio_seconds / (audio.tell() or 1)
+
+    def upload(segment):
+        start, end = segment
+        with lock:
+            audio.seek(start)
+            data = audio.read(end - start)
+        with JOBS.attach(job), stage_timer("upload"):
+            return genai.upload_file(io.BytesIO(data), mime_type="audio/mpeg")
+
+    def try_upload(segment):
+        try:
+            return upload(segment)
+        except Exception:
+            METRICS.inc("rasrss_retries_total", stage="segment")
+            return None
+
+    def run(segment, audio_file):
+        start, end = segment
+        delays = _backoff_delays(SEGMENT_RETRY_INITIAL, SEGMENT_RETRY_MAX)
+        with JOBS.attach(job):
+            for attempt in range(1, SEGMENT_ATTEMPTS + 1):
+                try:
+                    if audio_file is None:
+                        audio_file = upload(segment)
+                        with stage_timer("wait_active"):
+                            (audio_file,) = wait_files_active(genai, [audio_file])
+                    return _generate_transcript(genai, audio_file, (end - start) * seconds_per_byte)
+                except QuotaExceeded:
+                    raise
+                except Exception as e:
+                    if attempt == SEGMENT_ATTEMPTS:
+                        raise RuntimeError(f"第 {segments.index(segment) + 1} 段轉錄失敗：{e}") from e
+                    METRICS.inc("rasrss_retries_total", stage="segment")
+                    time.sleep(next(delays))
+
+    with ThreadPoolExecutor(max_workers=parallelism) as pool:
+        uploaded = list(pool.map(try_upload, segments))
+        pending = [f for f in uploaded if f is not None]
+        with stage_timer("wait_active"):
+            ready = iter(wait_files_active(genai, pending, return_exceptions=True) if pending else [])
+        # 上傳失敗或處理失敗（FAILED / 逾時）的段留給 run 重新上傳
+        files = []
+        for f in uploaded:
+            if f is not None:
+                f = next(ready)
+                if isinstance(f, Exception):
+                    METRICS.inc("rasrss_retries_total", stage="segment")
+                    f = None
+            files.append(f)
+        texts = list(pool.map(run, segments, files))
+    return stitch_transcripts(texts)
+
+
+def transcribe_japanese_with_gemini(mp3_url, probe=None):
+    """用 AI Studio Gemini 產生日文逐字稿：下載 MP3 → 上傳 Gemini → 完整一字不漏、不摘要。
+
+    長節目依設定切成重疊的時間段平行轉錄後接合，避免單次輸出被截斷。probe 為已取得的 probe_audio 結果（可省略）。
+    """
     key = _get_gemini_key()
     if not key:
         raise ValueError("請在「AI API 設定」中選擇 AI Studio（Gemini）並輸入、儲存 Gemini API Key")
+    genai = _configure_gemini(key)
+    # 配額短時間內不會恢復就先延後，不必下載音訊
+    QUOTAS.check("gemini", GEMINI_MODEL_PRIORITY, "Gemini")
+    audio = None
     try:
-        import google.generativeai as genai
-    except ImportError:
-        raise RuntimeError("請安裝：pip install google-generativeai")
-    genai.configure(api_key=key)
-    tmp_path = None
-    try:
-        tmp_path = _download_mp3(mp3_url)
-        # 上傳音訊給 Gemini
-        audio_file = genai.upload_file(tmp_path, mime_type="audio/mpeg")
-        # 輪詢直到處理完成
-        for _ in range(60):
-            if audio_file.state.name == "ACTIVE":
-                break
-            if audio_file.state.name == "FAILED":
-                raise RuntimeError(audio_file.state.name or "上傳失敗")
-            time.sleep(2)
-        prompt = "此為日文音訊。請產出完整逐字稿，一字不漏、不摘要，只輸出日文文字，不要其他說明。"
-        last_err = None
-        for model_name in GEMINI_MODEL_PRIORITY:
-            try:
-                model = genai.GenerativeModel(model_name)
-                response = model.generate_content([audio_file, prompt])
-                if response.text:
-                    return (response.text or "").strip()
-            except Exception as e:
-                last_err = e
-                continue
-        raise RuntimeError(f"Gemini 無可用模型：{last_err}")
+        job_event("downloading")
+        audio = download_audio(mp3_url, probe)
+        audio_seconds = mp3_duration(audio)
+        record_job_metrics(audio_seconds=round(audio_seconds, 1))
+        segment_minutes, parallelism = _transcribe_settings()
+        if segment_minutes:
+            segments = mp3_segments(audio, segment_minutes * 60, SEGMENT_OVERLAP_SECONDS)
+            if segments and len(segments) > 1:
+                record_job_metrics(segments=len(segments))
+                # 分段時上傳與轉錄交錯進行，只發一次 transcribing
+                job_event("transcribing", segments=len(segments))
+                return transcribe_segments(genai, audio, segments, parallelism, audio_seconds)
+        # 上傳音訊給 Gemini（直接由記憶體 / 匿名暫存檔上傳）
+        audio.seek(0)
+        job_event("uploading")
+        with stage_timer("upload"):
+            audio_file = genai.upload_file(audio, mime_type="audio/mpeg")
+        started = time.monotonic()
+        with stage_timer("wait_active"):
+            (audio_file,) = wait_files_active(genai, [audio_file])
+        record_job_metrics(upload_wait_seconds=round(time.monotonic() - started, 3))
+        job_event("transcribing")
+        return _generate_transcript(genai, audio_file, audio_seconds)
     finally:
-        if tmp_path and os.path.exists(tmp_path):
-            try:
-                os.unlink(tmp_path)
-            except OSError:
-                pass
+        if audio is not None:
+            audio.close()
 
 
 def safe_filename(s):
@@ -294,174 +2027,1340 @@ def safe_filename(s):
     return (s or "episode")[:120]
 
 
-def write_transcripts_index():
-    """掃描 docs/transcripts/*.md 並寫入 index.html，避免 GitHub Pages 點目錄 404。"""
-    index_path = os.path.join(PAGES_DIR, "index.html")
-    md_files = sorted(
-        [f for f in os.listdir(PAGES_DIR) if f.endswith(".md")],
-        key=lambda x: x,
-        reverse=True,
-    )
+def _pages_html(title, body_lines):
+    """GitHub Pages 逐字稿頁面共用的 HTML 外框。"""
     lines = [
         "<!DOCTYPE html>",
         '<html lang="zh-TW">',
         "<head>",
         '  <meta charset="UTF-8">',
         '  <meta name="viewport" content="width=device-width, initial-scale=1.0">',
-        "  <title>逐字稿列表 | rasrss</title>",
+        f"  <title>{html.escape(title)} | rasrss</title>",
         "  <style>",
         "    :root { --bg: #1a1a1e; --text: #e4e4e7; --muted: #a1a1aa; --link: #7dd3fc; --link-hover: #bae6fd; }",
         "    body { font-family: sans-serif; max-width: 720px; margin: 2rem auto; padding: 0 1rem; background: var(--bg); color: var(--text); min-height: 100vh; }",
         "    h1 { margin-bottom: 0.5rem; color: var(--text); }",
+        "    h2 { margin-top: 1.5rem; font-size: 1.1rem; color: var(--text); }",
+        "    h3 { margin: 0.75rem 0 0; font-size: 0.95rem; color: var(--muted); }",
         "    p { color: var(--muted); }",
         "    a { color: var(--link); text-decoration: none; }",
         "    a:hover { color: var(--link-hover); }",
         "    ul { list-style: none; padding: 0; }",
         "    ul li { margin: 0.5rem 0; }",
+        "    .time { color: var(--muted); font-size: 0.85rem; margin-right: 0.5rem; }",
         "  </style>",
         "</head>",
         "<body>",
+        *body_lines,
+        "</body>",
+        "</html>",
+    ]
+    return "\n".join(lines)
+
+
+def _transcript_slug(row):
+    """逐字稿頁面檔名（不含 .md）；舊資料沒有 page_slug 時依標題與建立時間推算。"""
+    return row["page_slug"] or safe_filename(row["episode_title"] or "episode") + "_" + row["created_at"].replace(":", "-")[:19]
+
+
+def _next_month(month):
+    """'2026-02' → '2026-03'，作為月份範圍查詢的上界。"""
+    year, mon = map(int, month.split("-"))
+    return f"{year + mon // 12:04d}-{mon % 12 + 1:02d}"
+
+
+def _write_month_page(conn, month):
+    """寫入單月頁面 <YYYY-MM>.html：依日期（新到舊）再依訂閱來源分組。"""
+    rows = conn.execute(
+        """SELECT t.episode_title, t.created_at, t.page_slug, f.title AS feed_title, f.rss_url
+           FROM transcripts t LEFT JOIN feeds f ON f.id = t.feed_id
+           WHERE t.created_at >= ? AND t.created_at < ?
+           ORDER BY t.created_at DESC, t.id DESC""",
+        (month, _next_month(month)),
+    ).fetchall()
+    path = os.path.join(PAGES_DIR, f"{month}.html")
+    if not rows:
+        if os.path.exists(path):
+            os.unlink(path)
+        return path
+    groups = {}  # date -> feed -> [row]，dict 保留插入順序即為時間順序
+    for r in rows:
+        feed_name = r["feed_title"] or r["rss_url"] or "（已刪除的訂閱）"
+        groups.setdefault(r["created_at"][:10], {}).setdefault(feed_name, []).append(r)
+    body = [
+        f"  <h1>📻 逐字稿 {month}</h1>",
+        '  <p><a href="./">← 所有月份</a></p>',
+    ]
+    for date, feeds in groups.items():
+        body.append(f"  <h2>{date}</h2>")
+        for feed_name, items in feeds.items():
+            body.append(f"  <h3>{html.escape(feed_name)}</h3>")
+            body.append("  <ul>")
+            for r in items:
+                href = quote(_transcript_slug(r) + ".md")
+                title = html.escape(r["episode_title"] or "Episode")
+                body.append(f'    <li><span class="time">{r["created_at"][11:16]}</span><a href="{href}">{title}</a></li>')
+            body.append("  </ul>")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(_pages_html(f"逐字稿 {month}", body))
+    return path
+
+
+def write_transcripts_index(months=None):
+    """依資料庫產生 docs/transcripts/index.html（月份目錄）與各月份頁面，避免 GitHub Pages 點目錄 404。
+
+    months 為本次有變動的月份（YYYY-MM）；只重寫這些月份與尚未產生過的月份頁面，None 表示全部重建。
+    回傳寫入（或刪除）的檔案路徑。
+    """
+    Path(PAGES_DIR).mkdir(parents=True, exist_ok=True)
+    conn = get_db()
+    counts = conn.execute(
+        "SELECT substr(created_at, 1, 7) AS month, COUNT(*) AS n FROM transcripts GROUP BY month ORDER BY month DESC"
+    ).fetchall()
+    all_months = [r["month"] for r in counts]
+    if months is None:
+        targets = set(all_months)
+    else:
+        targets = set(months) | {m for m in all_months if not os.path.exists(os.path.join(PAGES_DIR, f"{m}.html"))}
+    paths = [_write_month_page(conn, m) for m in sorted(targets)]
+    body = [
         "  <h1>📻 逐字稿列表</h1>",
         '  <p><a href="../">← 回 rasrss 首頁</a></p>',
         "  <ul>",
     ]
-    for f in md_files:
-        name = f[:-3]  # 去掉 .md
-        href = quote(f)
-        lines.append(f'    <li><a href="{href}">{name}</a></li>')
-    lines.extend(["  </ul>", "</body>", "</html>"])
+    for r in counts:
+        body.append(f'    <li><a href="{r["month"]}.html">{r["month"]}</a>（{r["n"]} 篇）</li>')
+    body.append("  </ul>")
+    index_path = os.path.join(PAGES_DIR, "index.html")
     with open(index_path, "w", encoding="utf-8") as f:
-        f.write("\n".join(lines))
-    return index_path
+        f.write(_pages_html("逐字稿列表", body))
+    return paths + [index_path]
 
 
-def push_transcript_to_github(title, transcript_text, episode_slug):
-    """將逐字稿寫入 docs/transcripts 並 push 到 origin（若為同一 repo）。"""
+def write_transcript_page(title, transcript_text, episode_slug):
+    """將逐字稿寫入 docs/transcripts/<slug>.md，回傳相對 repo 的路徑。"""
     Path(PAGES_DIR).mkdir(parents=True, exist_ok=True)
-    filename = f"{episode_slug}.md"
-    filepath = os.path.join(PAGES_DIR, filename)
-    rel_path = os.path.relpath(filepath, REPO_ROOT)
+    filepath = os.path.join(PAGES_DIR, f"{episode_slug}.md")
     with open(filepath, "w", encoding="utf-8") as f:
         f.write(f"# {title}\n\n")
         f.write(transcript_text)
-    write_transcripts_index()
-    index_rel = os.path.relpath(os.path.join(PAGES_DIR, "index.html"), REPO_ROOT)
+    return os.path.relpath(filepath, REPO_ROOT)
+
+
+def _push_origin(repo):
+    """push 到 origin，失敗時以指數退避重試；仍失敗則拋出最後的錯誤。"""
+    delays = _backoff_delays(PUBLISH_RETRY_INITIAL, PUBLISH_RETRY_MAX)
+    for attempt in range(1, PUBLISH_PUSH_ATTEMPTS + 1):
+        try:
+            result = repo.remotes.origin.push()
+            errors = [info.summary.strip() for info in result if info.flags & info.ERROR]
+            if errors:
+                raise RuntimeError("; ".join(errors))
+            return
+        except Exception:
+            if attempt == PUBLISH_PUSH_ATTEMPTS:
+                raise
+            METRICS.inc("rasrss_retries_total", stage="git_push")
+            time.sleep(next(delays))
+
+
+class Publisher:
+    """GitHub Pages 發佈：收集完成的逐字稿，依時間窗或批次大小合併為一次 commit + 一次 push。
+
+    轉錄 worker 只需 submit()，寫檔與 git 操作都在單一發佈執行緒內並持有 git lock；
+    push 失敗時 commit 留在本地，下個時間窗再推。
+    """
+
+    def __init__(self, window, batch_size):
+        self._window = window
+        self._batch_size = batch_size
+        self._cond = threading.Condition()
+        self._git_lock = threading.Lock()
+        self._pending = []
+        self._oldest = None
+        self._unpushed = False
+        self._suspended = False
+        self._thread = None
+        self.last_push_at = None
+        self.last_error = None
+
+    def start(self):
+        """啟動發佈執行緒，並補發前一個排程行程（失去租約或當機）未發佈的逐字稿。"""
+        with self._cond:
+            self._suspended = False
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, name="rasrss-publisher", daemon=True)
+                self._thread.start()
+        try:
+            unpublished = unpublished_transcripts()
+        except Exception as e:
+            print(f"[rasrss] 檢查未發佈的逐字稿失敗: {e}")
+            return
+        for item in unpublished:
+            self.submit(*item)
+        if unpublished:
+            print(f"[rasrss] 補發 {len(unpublished)} 篇未發佈的逐字稿")
+
+    def submit(self, title, transcript_text, episode_slug, created_at):
+        """排入待發佈的逐字稿，立即返回；暫停中（已失去排程租約）時忽略，由下一個持有者補發。"""
+        with self._cond:
+            if self._suspended:
+                return
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.append((title, transcript_text, episode_slug, created_at))
+            self._cond.notify()
+
+    def stop(self):
+        """立即發佈尚未送出的逐字稿（程式結束前呼叫）。"""
+        with self._cond:
+            batch, self._pending = self._pending, []
+        if batch or self._unpushed:
+            self.publish(batch)
+
+    def suspend(self):
+        """失去排程租約時呼叫：丟棄尚未發佈的逐字稿（由下一個持有者啟動時補發），等待進行中的 git 操作結束，
+        之後不再寫檔、commit 或 push，直到再次 start()。"""
+        with self._cond:
+            self._suspended = True
+            self._pending = []
+            self._unpushed = False
+            self._cond.notify()
+        with self._git_lock:
+            pass
+
+    def status(self):
+        with self._cond:
+            return {
+                "pending": len(self._pending),
+                "unpushed": self._unpushed,
+                "last_push_at": self.last_push_at,
+                "last_error": self.last_error,
+            }
+
+    def _take_batch(self):
+        with self._cond:
+            while True:
+                if self._pending:
+                    due = self._oldest + self._window
+                    if len(self._pending) >= self._batch_size or time.monotonic() >= due:
+                        batch, self._pending = self._pending, []
+                        return batch
+                    self._cond.wait(due - time.monotonic())
+                elif self._unpushed:
+                    if not self._cond.wait(self._window):
+                        return []  # 沒有新逐字稿，單純重推先前失敗的 commit
+                else:
+                    self._cond.wait()
+
+    def _run(self):
+        while True:
+            self.publish(self._take_batch())
+
+    def publish(self, batch):
+        """寫入一批逐字稿、更新索引，並以單一 commit + push 發佈。"""
+        with self._git_lock:
+            if self._suspended:
+                return
+            try:
+                # 已失去排程租約：交給接手的行程補發，避免兩個行程同時操作同一個 git 工作目錄
+                PIPELINE.fence()
+                paths = [write_transcript_page(title, text, slug) for title, text, slug, _ in batch]
+                names = [os.path.basename(p) for p in paths]
+                if batch:
+                    # 只重寫本批逐字稿所在月份的索引頁
+                    months = {created_at[:7] for _, _, _, created_at in batch}
+                    paths += [os.path.relpath(p, REPO_ROOT) for p in write_transcripts_index(months)]
+                repo = Repo(REPO_ROOT)
+                if repo.bare or not repo.remotes:
+                    raise RuntimeError("本地非 git 或無遠端")
+                if paths:
+                    if len(names) == 1:
+                        message = f"transcript: {names[0]}"
+                    else:
+                        message = f"transcripts: {len(names)} 篇\n\n" + "\n".join(names)
+                    repo.index.add([p for p in paths if os.path.exists(os.path.join(REPO_ROOT, p))])
+                    removed = [p for p in paths if not os.path.exists(os.path.join(REPO_ROOT, p))]
+                    if removed:
+                        repo.index.remove(removed, ignore_unmatch=True)
+                    repo.index.commit(message)
+                self._unpushed = True
+                # 一次 push 涵蓋多個 feed，不帶 feed label
+                with stage_timer("git_push"):
+                    _push_origin(repo)
+                self._unpushed = False
+                self.last_push_at = datetime.utcnow().isoformat() + "Z"
+                self.last_error = None
+                if batch:
+                    EVENTS.publish("published", slugs=[slug for _, _, slug, _ in batch], pushed_at=self.last_push_at)
+            except LeaseLost:
+                print(f"[rasrss] 已失去排程租約，{len(batch)} 篇逐字稿留給接手的行程發佈")
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"[rasrss] GitHub push 失敗: {e}")
+
+
+def unpublished_transcripts():
+    """頁面檔不存在或尚未加入 git 的逐字稿，回傳 Publisher.submit 的參數列表。
+
+    發佈在背景批次進行，排程行程失去租約或當機時已寫入資料庫的逐字稿可能還沒發佈；由下一個持有者啟動時補發。
+    """
     try:
         repo = Repo(REPO_ROOT)
-        if repo.bare or not repo.remotes:
-            return False, "本地非 git 或無遠端"
-        repo.index.add([rel_path, index_rel])
-        repo.index.commit(f"transcript: {filename}")
-        origin = repo.remotes.origin
-        origin.push()
-        return True, None
-    except Exception as e:
-        return False, str(e)
+        # 沒有遠端時本來就無法發佈，不必每次啟動都重寫所有頁面
+        untracked = set(repo.untracked_files) if repo.remotes else set()
+    except Exception:
+        untracked = set()
+    rows = get_db().execute(
+        "SELECT id, episode_title, page_slug, created_at FROM transcripts WHERE page_slug IS NOT NULL AND page_slug != ''"
+    ).fetchall()
+    items = []
+    for row in rows:
+        path = os.path.join(PAGES_DIR, f"{row['page_slug']}.md")
+        if os.path.exists(path) and os.path.relpath(path, REPO_ROOT) not in untracked:
+            continue
+        text = load_transcript_text(row["id"])
+        if text is not None:
+            items.append((row["episode_title"] or "Episode", text, row["page_slug"], row["created_at"]))
+    return items
 
 
-def run_feed_job(feed_id):
-    conn = get_db()
-    row = conn.execute(
-        "SELECT id, rss_url, title, schedule_minutes FROM feeds WHERE id = ?",
-        (feed_id,),
-    ).fetchone()
-    conn.close()
+PUBLISHER = Publisher(PUBLISH_WINDOW_SECONDS, PUBLISH_BATCH_SIZE)
+METRICS.describe("rasrss_publish_pending", "gauge", "等待發佈到 GitHub Pages 的逐字稿數", lambda: PUBLISHER.status()["pending"])
+
+
+# 檢查 feed 時需要的欄位（手動執行與排程輪詢共用）
+FEED_CHECK_COLUMNS = "id, rss_url, title, schedule_minutes, etag, last_modified, content_hash, max_backlog"
+
+
+def run_feed_job(feed_id, priority=PRIORITY_SCHEDULED):
+    """檢查單一 feed（手動「立即執行」）：找出所有未處理的集數並逐一排入工作佇列。"""
+    row = get_db().execute(f"SELECT {FEED_CHECK_COLUMNS} FROM feeds WHERE id = ?", (feed_id,)).fetchone()
     if not row:
         return
-    rss_url = row["rss_url"]
-    title, link, mp3_url = get_latest_mp3_from_rss(rss_url)
-    if not mp3_url:
+    try:
+        episodes, etag, last_modified, content_hash = fetch_feed(
+            row["rss_url"], row["etag"], row["last_modified"], row["content_hash"],
+            is_known=lambda url: already_processed(feed_id, url),
+            depth=_feed_backlog(row),
+        )
+        pending = pending_episodes(row, episodes)
+    except Exception:
+        reschedule_feed(feed_id, failed=True)
+        raise
+    dispatch_feed(row, pending, etag, last_modified, content_hash, priority)
+
+
+def _feed_backlog(row):
+    return max(1, row["max_backlog"] or DEFAULT_MAX_BACKLOG)
+
+
+def pending_episodes(row, episodes):
+    """尚未處理的集數（由舊到新，受 max_backlog 限制）；episodes 為 None（未變更）時為空。"""
+    if episodes is None:
+        return []
+    return unseen_episodes(row["id"], episodes[-_feed_backlog(row):])
+
+
+# 每次檢查 feed 排入的集數共用一個檢查編號；同一次檢查的集數失敗只累加一次 fail_count
+_check_ids = itertools.count(1)
+_failed_checks = {}  # feed_id -> 最近一次已計入失敗的檢查編號
+_failed_checks_lock = threading.Lock()
+
+
+def _count_check_failure(feed_id, check_id):
+    """同一次檢查第一個失敗的集數回傳 True（累加失敗次數），其餘回傳 None（維持不變）。"""
+    with _failed_checks_lock:
+        if check_id is not None and _failed_checks.get(feed_id) == check_id:
+            return None
+        _failed_checks[feed_id] = check_id
+        return True
+
+
+def dispatch_feed(row, pending, etag, last_modified, content_hash, priority=PRIORITY_SCHEDULED):
+    """依檢查結果重新排程 feed；只有出現未處理的集數時才排入轉錄工作。已失去排程租約時拋出 LeaseLost。"""
+    PIPELINE.fence()
+    feed_id = row["id"]
+    if not pending:
+        # RSS 未變更（304 或內容相同）或沒有新集數：記錄驗證資訊，失敗計數歸零
+        _save_feed_validators(feed_id, etag, last_modified, content_hash)
+        reschedule_feed(feed_id, failed=False)
         return
+    # 仍有集數待處理時不記錄驗證資訊，下次檢查會重新比對，失敗的集數因此得以重試；
+    # 失敗計數留給集數的轉錄結果決定
+    reschedule_feed(feed_id)
+    check_id = next(_check_ids)
+    for title, link, mp3_url in pending:
+        JOBS.submit(
+            ("episode", feed_id, mp3_url),
+            process_episode,
+            (feed_id, title, link, mp3_url, check_id),
+            priority=priority,
+            feed_id=feed_id,
+            label=title or mp3_url,
+        )
+
+
+def process_episode(feed_id, title, link, mp3_url, check_id=None):
+    """轉錄單一集並寫入資料庫與 GitHub Pages；音訊指紋命中既有逐字稿時直接沿用。
+
+    check_id 為排入此集的 feed 檢查編號：同一次檢查有多集失敗時，失敗次數只累加一次。
+    """
     if already_processed(feed_id, mp3_url):
+        METRICS.inc("rasrss_episodes_total", feed=feed_id, result="skip")
         return
-    try:
-        transcript_text = transcribe_japanese_with_gemini(mp3_url)
-    except Exception as e:
-        err_msg = str(e)
-        print(f"[rasrss] feed {feed_id} 轉錄失敗: {err_msg}")
-        conn = get_db()
-        conn.execute("UPDATE feeds SET last_error = ? WHERE id = ?", (err_msg, feed_id))
-        conn.commit()
-        conn.close()
+    # 音訊指紋（HEAD + 兩次 Range）記在工作上，配額用盡而延後重試時不再重抓；
+    # probe 不保留（最終網址可能是有時效的簽章網址），重試時由下載自行 HEAD
+    job = JOBS.current()
+    memo = job.memo if job is not None else {}
+    probe = None
+    fingerprints = memo.get("fingerprints")
+    if fingerprints is None:
+        probe = probe_audio(mp3_url)
+        fingerprints = audio_fingerprints(probe)
+        if fingerprints:
+            memo["fingerprints"] = fingerprints
+    with _claim_fingerprints(fingerprints):
+        cached = find_cached_transcript(feed_id, fingerprints)
+        now = datetime.utcnow().isoformat() + "Z"
+        if cached is not None and cached["feed_id"] == feed_id:
+            # 同一 feed 已轉錄過相同音訊（重新上架或換了 CDN 網址）：只標記已處理，不另建逐字稿
+            with transaction() as conn:
+                mark_processed(feed_id, mp3_url)
+                _save_fingerprints(conn, fingerprints, cached["id"], now)
+                conn.execute("UPDATE feeds SET last_error = NULL, fail_count = 0 WHERE id = ?", (feed_id,))
+                PIPELINE.fence(conn)
+            record_job_metrics(dedup_transcript_id=cached["id"])
+            job_event("skipped", transcript_id=cached["id"])
+            METRICS.inc("rasrss_episodes_total", feed=feed_id, result="skip")
+            print(f"[rasrss] 音訊與逐字稿 #{cached['id']} 相同，略過：{mp3_url}")
+            return
+        if cached is not None:
+            # 其他 feed 轉錄過相同音訊：複製逐字稿，不重新上傳
+            transcript_text = load_transcript_text(cached["id"])
+            record_job_metrics(dedup_transcript_id=cached["id"])
+        else:
+            try:
+                transcript_text = transcribe_japanese_with_gemini(mp3_url, probe)
+            except QuotaExceeded:
+                # 配額用盡不是 feed 的錯：不記 last_error、不退避，由工作佇列延後重試
+                METRICS.inc("rasrss_episodes_total", feed=feed_id, result="deferred")
+                raise
+            except Exception as e:
+                with transaction() as conn:
+                    conn.execute("UPDATE feeds SET last_error = ? WHERE id = ?", (str(e), feed_id))
+                    # 轉錄失敗：依連續失敗次數退避後再檢查此 feed（同一次檢查只累加一次）
+                    reschedule_feed(feed_id, failed=_count_check_failure(feed_id, check_id))
+                METRICS.inc("rasrss_episodes_total", feed=feed_id, result="failure")
+                raise
+            now = datetime.utcnow().isoformat() + "Z"
+        slug = safe_filename(title or "episode") + "_" + now.replace(":", "-")[:19]
+        # 寫入逐字稿與指紋、標記已處理、更新 last_run_at 並清除錯誤與失敗計數，同一個交易完成
+        with stage_timer("db_write"), transaction() as conn:
+            transcript_id = save_transcript(conn, feed_id, title or "", link or "", mp3_url, transcript_text, now, slug)
+            _save_fingerprints(conn, fingerprints, transcript_id, now)
+            mark_processed(feed_id, mp3_url)
+            conn.execute(
+                "UPDATE feeds SET last_run_at = ?, last_error = NULL, fail_count = 0 WHERE id = ?", (now, feed_id)
+            )
+            # 交易最後確認仍持有排程租約（此時已持有寫入鎖）：失去租約則整筆 rollback，由接手的行程轉錄
+            PIPELINE.fence(conn)
+    METRICS.inc("rasrss_episodes_total", feed=feed_id, result="success")
+    # 附上與 /api/transcripts 相同格式的列表項目，頁面可直接插入而不必重新載入
+    job_event("saved", transcript={
+        "id": transcript_id,
+        "feed_id": feed_id,
+        "episode_title": title or "",
+        "episode_url": link or "",
+        "mp3_url": mp3_url,
+        "created_at": now,
+        "preview": transcript_text[:TRANSCRIPT_PREVIEW_CHARS],
+        "transcript_length": len(transcript_text),
+    })
+    # 交給發佈執行緒批次寫入 GitHub Pages，不在此等待 git
+    PUBLISHER.submit(title or "Episode", transcript_text, slug, now)
+
+
+class EventBus:
+    """工作進度事件的發佈 / 訂閱（供 /api/events SSE 使用）。
+
+    每個連線一個有上限的佇列，連線太慢時只會漏掉事件而不會卡住 worker；
+    保留最近 EVENT_HISTORY 筆，瀏覽器重連時依 Last-Event-ID 補送。
+    """
+
+    def __init__(self, history, queue_size):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._history = deque(maxlen=history)
+        self._queue_size = queue_size
+        self._subscribers = set()
+
+    def publish(self, event_type, **data):
+        with self._lock:
+            event = {"id": next(self._ids), "type": event_type, "time": datetime.utcnow().isoformat() + "Z", **data}
+            self._history.append(event)
+            for q in self._subscribers:
+                try:
+                    q.put_nowait(event)
+                except queue.Full:
+                    pass
+        return event
+
+    def subscribe(self, last_id=None):
+        q = queue.Queue(maxsize=self._queue_size)
+        with self._lock:
+            if last_id is not None:
+                for event in self._history:
+                    if event["id"] > last_id:
+                        q.put_nowait(event)
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+
+EVENTS = EventBus(EVENT_HISTORY, EVENT_QUEUE_SIZE)
+
+
+def job_event(event_type, job=None, **data):
+    """發佈工作事件（預設為目前執行緒的工作；不在 worker 中時忽略），附上自排入 / 開始起算的秒數。"""
+    job = job or JOBS.current()
+    if job is None:
         return
-    # 成功則清除錯誤
-    conn = get_db()
-    conn.execute("UPDATE feeds SET last_error = NULL WHERE id = ?", (feed_id,))
-    conn.commit()
-    conn.close()
-    now = datetime.utcnow().isoformat() + "Z"
-    conn = get_db()
-    conn.execute(
-        """INSERT INTO transcripts (feed_id, episode_title, episode_url, mp3_url, transcript_text, created_at)
-           VALUES (?, ?, ?, ?, ?, ?)""",
-        (feed_id, title or "", link or "", mp3_url, transcript_text, now),
+    now = time.time()
+    EVENTS.publish(
+        event_type,
+        job_id=job.id,
+        kind=job.kind,
+        feed_id=job.feed_id,
+        label=job.label,
+        queued_seconds=round(now - job.queued_at, 3),
+        run_seconds=round(now - job.started_at, 3) if job.started_at else None,
+        **data,
     )
-    conn.commit()
-    conn.close()
-    mark_processed(feed_id, mp3_url)
-    # 更新 last_run_at
-    conn = get_db()
-    conn.execute("UPDATE feeds SET last_run_at = ? WHERE id = ?", (now, feed_id))
-    conn.commit()
-    conn.close()
-    # 寫入 GitHub Pages
-    slug = safe_filename(title or "episode") + "_" + now.replace(":", "-")[:19]
-    ok, err = push_transcript_to_github(title or "Episode", transcript_text, slug)
-    if not ok:
-        print(f"[rasrss] GitHub push 失敗: {err}")
 
 
-def scheduler_tick():
-    conn = get_db()
-    feeds = conn.execute(
-        "SELECT id, schedule_minutes, last_run_at FROM feeds"
-    ).fetchall()
-    conn.close()
-    now = datetime.utcnow()
-    for row in feeds:
+class Job:
+    """佇列中的單一工作：kind 為 "feed"（檢查 RSS）或 "episode"（轉錄一集）。
+
+    status：queued → running → done / failed；AI 配額用盡時為 deferred，到 not_before 後回到 queued；
+    佇列停止（失去排程租約或結束行程）時尚未執行的工作為 cancelled。
+    """
+
+    def __init__(self, job_id, key, fn, args, priority, feed_id=None, label=None):
+        self.id = job_id
+        self.key = key
+        self.kind = key[0]
+        self.fn = fn
+        self.args = args
+        self.feed_id = feed_id
+        self.label = label
+        self.priority = priority
+        self.status = "queued"
+        self.error = None
+        self.queued_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.not_before = None
+        self.metrics = {}
+        self.memo = {}  # 延後重試之間保留的中間結果（例如音訊指紋），不回傳給 API
+
+    def to_dict(self):
+        now = time.time()
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "feed_id": self.feed_id,
+            "label": self.label,
+            "priority": self.priority,
+            "status": self.status,
+            "error": self.error,
+            "queued_at": datetime.utcfromtimestamp(self.queued_at).isoformat() + "Z",
+            "wait_seconds": round((self.started_at or now) - self.queued_at, 3),
+            "run_seconds": round((self.finished_at or now) - self.started_at, 3) if self.started_at else None,
+            "not_before": datetime.utcfromtimestamp(self.not_before).isoformat() + "Z" if self.not_before else None,
+            "metrics": dict(self.metrics),
+        }
+
+
+class JobQueue:
+    """有上限的 worker pool + 優先佇列；同一 key 同時只會有一個工作在佇列、延後或執行中。
+
+    工作拋出 QuotaExceeded 時不算失敗：放進延後佇列，到時間再依原優先序排回。
+    """
+
+    def __init__(self, workers):
+        self._workers = workers
+        self._cond = threading.Condition()
+        self._heap = []
+        self._delayed = []  # (not_before, seq, job)
+        self._seq = itertools.count()
+        self._ids = itertools.count(1)
+        self._inflight = {}  # key -> Job（queued 或 running）
+        self._finished = deque(maxlen=JOB_HISTORY)
+        self._threads = []
+        self._generation = 0  # stop() 後遞增，舊的 worker 做完手上的工作即結束
+        self._on_cancel = None
+        self._local = threading.local()
+
+    def start(self):
+        with self._cond:
+            if self._threads:
+                return
+            self._on_cancel = None
+            for i in range(self._workers):
+                t = threading.Thread(
+                    target=self._worker, args=(self._generation,), name=f"rasrss-worker-{i}", daemon=True
+                )
+                t.start()
+                self._threads.append(t)
+
+    def stop(self, on_cancel=None):
+        """停止 worker 並取消所有排隊中與延後的工作（執行中的工作照常完成），之後送入的工作也直接取消。
+
+        被取消的工作會交給 on_cancel(jobs)（例如讓接手的行程重新排入）；可再呼叫 start() 重新啟動。
+        """
+        with self._cond:
+            self._generation += 1
+            self._threads = []
+            self._on_cancel = on_cancel
+            cancelled = [job for job in self._inflight.values() if job.status != "running"]
+            for job in cancelled:
+                self._cancel(job)
+            self._heap = []
+            self._delayed = []
+            self._cond.notify_all()
+        self._cancelled(cancelled)
+        return cancelled
+
+    def submit(self, key, fn, args=(), priority=PRIORITY_SCHEDULED, feed_id=None, label=None):
+        """排入工作，回傳 (job, joined)；同 key 已有工作時直接加入既有工作（必要時提高優先序）。"""
+        with self._cond:
+            if not self._threads:
+                # 已停止：停止前仍在執行的工作（例如 feed 檢查）排入的後續工作直接取消
+                job = Job(next(self._ids), key, fn, args, priority, feed_id, label)
+                self._cancel(job)
+                cancelled = True
+            else:
+                cancelled = False
+                job = self._inflight.get(key)
+                if job:
+                    if job.status == "queued" and priority < job.priority:
+                        # 舊的 heap 項目會在取出時因優先序不符而略過
+                        job.priority = priority
+                        heapq.heappush(self._heap, (priority, next(self._seq), job))
+                        self._cond.notify()
+                    return job, True
+                job = Job(next(self._ids), key, fn, args, priority, feed_id, label)
+                self._inflight[key] = job
+                heapq.heappush(self._heap, (priority, next(self._seq), job))
+                self._cond.notify()
+        if cancelled:
+            self._cancelled([job])
+        else:
+            job_event("queued", job, priority=priority)
+        return job, False
+
+    def current(self):
+        """目前執行緒正在執行的工作（不在 worker 中時為 None）。"""
+        return getattr(self._local, "job", None)
+
+    @contextmanager
+    def attach(self, job):
+        """讓輔助執行緒（例如分段轉錄的 thread pool）以指定工作的身分記錄量測與事件。"""
+        previous = self.current()
+        self._local.job = job
+        try:
+            yield
+        finally:
+            self._local.job = previous
+
+    def counts(self):
+        """(排隊中（含延後）, 執行中) 的工作數。"""
+        with self._cond:
+            running = sum(1 for j in self._inflight.values() if j.status == "running")
+            return len(self._inflight) - running, running
+
+    def snapshot(self):
+        with self._cond:
+            inflight = sorted(self._inflight.values(), key=lambda j: (j.priority, j.id))
+            return {
+                "workers": self._workers,
+                "queued": [j.to_dict() for j in inflight if j.status == "queued"],
+                "running": [j.to_dict() for j in inflight if j.status == "running"],
+                "deferred": [j.to_dict() for j in inflight if j.status == "deferred"],
+                "finished": [j.to_dict() for j in self._finished],
+            }
+
+    def _promote_delayed(self):
+        """把到時間的延後工作排回佇列，回傳距下一個延後工作的秒數（沒有則 None）。須持有 self._cond。"""
+        now = time.time()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, job = heapq.heappop(self._delayed)
+            job.status = "queued"
+            heapq.heappush(self._heap, (job.priority, next(self._seq), job))
+        return self._delayed[0][0] - now if self._delayed else None
+
+    def _next_job(self, generation):
+        """取出下一個工作；佇列已停止（generation 不同）時回傳 None。"""
+        with self._cond:
+            while True:
+                if generation != self._generation:
+                    return None
+                timeout = self._promote_delayed()
+                if not self._heap:
+                    self._cond.wait(timeout)
+                    continue
+                priority, _, job = heapq.heappop(self._heap)
+                if job.status == "queued" and priority == job.priority:
+                    job.status = "running"
+                    job.started_at = time.time()
+                    return job
+
+    def _worker(self, generation):
+        while True:
+            job = self._next_job(generation)
+            if job is None:
+                return
+            self._local.job = job
+            job_event("running", job)
+            try:
+                job.fn(*job.args)
+                status, error = "done", None
+            except QuotaExceeded as e:
+                self._defer(job, e)
+                continue
+            except LeaseLost:
+                # 執行中失去排程租約：結果未寫入，交給接手的行程
+                with self._cond:
+                    self._cancel(job)
+                self._cancelled([job])
+                continue
+            except Exception as e:
+                status, error = "failed", str(e)
+                print(f"[rasrss] feed {job.feed_id} {job.kind} 工作失敗: {error}")
+            finally:
+                self._local.job = None
+            with self._cond:
+                job.status = status
+                job.error = error
+                job.finished_at = time.time()
+                self._inflight.pop(job.key, None)
+                self._finished.appendleft(job)
+            METRICS.inc("rasrss_jobs_total", kind=job.kind, status=status)
+            job_event(status, job, error=error, metrics=dict(job.metrics))
+
+    def _defer(self, job, exc):
+        retry_after = max(exc.retry_after, QUOTA_DEFER_MIN)
+        with self._cond:
+            cancelled = not self._threads
+            if cancelled:
+                # 佇列已停止（失去排程租約）：不再延後，交給接手的行程
+                self._cancel(job)
+            else:
+                job.status = "deferred"
+                job.error = str(exc)
+                job.not_before = time.time() + retry_after
+                heapq.heappush(self._delayed, (job.not_before, next(self._seq), job))
+                # 讓閒置的 worker 依新的延後工作重新計算等待時間
+                self._cond.notify_all()
+        if cancelled:
+            self._cancelled([job])
+            return
+        METRICS.inc("rasrss_jobs_total", kind=job.kind, status="deferred")
+        print(f"[rasrss] feed {job.feed_id} {job.kind} 工作延後 {round(retry_after)} 秒: {exc}")
+        job_event("deferred", job, error=str(exc), retry_after=round(retry_after))
+
+    def _cancel(self, job):
+        """將工作標為取消並移到歷史紀錄。須持有 self._cond。"""
+        job.status = "cancelled"
+        job.finished_at = time.time()
+        if self._inflight.get(job.key) is job:
+            del self._inflight[job.key]
+        self._finished.appendleft(job)
+
+    def _cancelled(self, jobs):
+        for job in jobs:
+            METRICS.inc("rasrss_jobs_total", kind=job.kind, status="cancelled")
+            job_event("cancelled", job)
+        if jobs and self._on_cancel:
+            try:
+                self._on_cancel(jobs)
+            except Exception as e:
+                print(f"[rasrss] 處理取消的工作失敗: {e}")
+
+
+JOBS = JobQueue(JOB_WORKERS)
+METRICS.describe("rasrss_queue_depth", "gauge", "排隊中的工作數", lambda: JOBS.counts()[0])
+METRICS.describe("rasrss_jobs_in_flight", "gauge", "執行中的工作數", lambda: JOBS.counts()[1])
+
+
+def record_job_metrics(**metrics):
+    """將量測值記到目前執行緒的工作上（於 worker 外呼叫時忽略）。"""
+    job = JOBS.current()
+    if job is not None:
+        job.metrics.update(metrics)
+
+
+def enqueue_feed(feed_id, priority=PRIORITY_SCHEDULED):
+    """排入 feed 檢查工作；集數會在檢查後另行排入，同一集不會重複執行。"""
+    return JOBS.submit(("feed", feed_id), run_feed_job, (feed_id, priority), priority=priority, feed_id=feed_id)
+
+
+def _parse_utc(value):
+    """解析資料庫中的 ISO 時間字串（結尾 Z）為 naive UTC datetime；無法解析回傳 None。"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def _feed_delay(schedule_minutes, fail_count):
+    """距下次檢查的秒數：正常依訂閱週期，連續失敗時指數退避；皆加上隨機抖動。"""
+    if fail_count:
+        delay = min(FEED_RETRY_INITIAL * 2 ** (fail_count - 1), FEED_RETRY_MAX)
+    else:
+        delay = schedule_minutes * 60
+    return delay + random.uniform(0, delay * FEED_JITTER_RATIO)
+
+
+def reschedule_feed(feed_id, failed=None):
+    """更新失敗計數並依此計算、寫入 next_run_at，並通知排程輪詢重新計算睡眠時間。
+
+    failed=True 累加失敗次數、False 歸零、None 維持不變。回傳下次執行時間；feed 已刪除時回傳 None。
+    """
+    with transaction() as conn:
+        row = conn.execute("SELECT schedule_minutes, fail_count FROM feeds WHERE id = ?", (feed_id,)).fetchone()
+        if not row:
+            return None
+        fail_count = row["fail_count"] or 0
+        if failed is True:
+            fail_count += 1
+        elif failed is False:
+            fail_count = 0
+        next_run = datetime.utcnow() + timedelta(seconds=_feed_delay(row["schedule_minutes"], fail_count))
+        conn.execute(
+            "UPDATE feeds SET fail_count = ?, next_run_at = ? WHERE id = ?",
+            (fail_count, next_run.isoformat() + "Z", feed_id),
+        )
+    POLLER.wake()
+    return next_run
+
+
+def run_feeds_now(feed_ids):
+    """將 feed 的下次檢查時間設為現在：交出排程租約時，未執行的集數由接手的行程重新檢查、排入。"""
+    feed_ids = sorted(set(feed_ids))
+    if not feed_ids:
+        return
+    now = datetime.utcnow().isoformat() + "Z"
+    with transaction() as conn:
+        conn.executemany("UPDATE feeds SET next_run_at = ? WHERE id = ?", [(now, feed_id) for feed_id in feed_ids])
+
+
+class FeedPoller:
+    """排程輪詢：單一執行緒睡到最早的 next_run_at，醒來後在一個 asyncio event loop 上同時檢查所有到期的 feed。
+
+    全域同時請求數受 concurrency 限制、同一 host 受 per_host 限制（避免集中打同一個 podcast CDN），
+    每個 feed 各自逾時；只有出現新集數的 feed 才會把集數排入工作佇列，其餘只更新驗證資訊與下次檢查時間。
+    """
+
+    def __init__(self, concurrency, per_host, timeout):
+        self._concurrency = concurrency
+        self._per_host = per_host
+        self._timeout = timeout
+        self._cond = threading.Condition()
+        self._woken = False
+        self._thread = None
+        self._generation = 0  # stop() 後遞增，舊的輪詢執行緒做完進行中的一輪即結束
+        self.last_tick = None
+
+    def start(self):
+        with self._cond:
+            if self._thread:
+                return
+            self._thread = threading.Thread(
+                target=self._run, args=(self._generation,), name="rasrss-poller", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """停止輪詢（進行中的一輪照常完成，不等待）；可再呼叫 start() 重新啟動。"""
+        with self._cond:
+            self._generation += 1
+            self._thread = None
+            self._woken = True
+            self._cond.notify()
+
+    def wake(self):
+        """有 feed 的下次檢查時間變動（新增訂閱、重新排程）時呼叫，輪詢執行緒會重新計算睡眠時間。"""
+        with self._cond:
+            self._woken = True
+            self._cond.notify()
+
+    def status(self):
+        return {"last_tick": self.last_tick}
+
+    def _seconds_until_due(self):
+        """距最早到期的 feed 還有幾秒（已到期為 0；沒有訂閱時為 POLL_MAX_SLEEP）。"""
+        row = get_db().execute("SELECT COUNT(*), MIN(COALESCE(next_run_at, '')) FROM feeds").fetchone()
+        if not row[0]:
+            return POLL_MAX_SLEEP
+        run_at = _parse_utc(row[1])
+        if run_at is None:
+            return 0  # 尚未排程過的 feed 立即檢查
+        return min(max(0.0, (run_at - datetime.utcnow()).total_seconds()), POLL_MAX_SLEEP)
+
+    def _run(self, generation):
+        while generation == self._generation:
+            try:
+                delay = self._seconds_until_due()
+                if delay <= 0:
+                    self.tick()
+                    continue
+            except Exception as e:
+                print(f"[rasrss] 排程輪詢失敗: {e}")
+                delay = self._timeout
+            with self._cond:
+                if not self._woken:
+                    self._cond.wait(delay)
+                self._woken = False
+
+    def tick(self):
+        """檢查所有已到期的 feed 一輪，回傳本輪統計（也記在 last_tick）。"""
+        started = time.monotonic()
+        now = datetime.utcnow().isoformat() + "Z"
+        rows = get_db().execute(
+            f"SELECT {FEED_CHECK_COLUMNS} FROM feeds WHERE next_run_at IS NULL OR next_run_at <= ? ORDER BY next_run_at",
+            (now,),
+        ).fetchall()
+        stats = {"started_at": now, "feeds": len(rows), "new_feeds": 0, "episodes": 0, "errors": 0, "bytes": 0}
+        if rows:
+            asyncio.run(self._check_all(rows, stats))
+        elapsed = time.monotonic() - started
+        stats["seconds"] = round(elapsed, 3)
+        self.last_tick = stats
+        if rows:
+            observe_stage("poll_tick", elapsed, feed="")
+            print(
+                f"[rasrss] 輪詢 {stats['feeds']} 個 feed：{stats['new_feeds']} 個有新集數（{stats['episodes']} 集）、"
+                f"{stats['errors']} 個失敗，讀取 {stats['bytes'] / 1024:.0f} KB，耗時 {elapsed:.2f} 秒"
+            )
+        return stats
+
+    async def _check_all(self, rows, stats):
+        limit = asyncio.Semaphore(self._concurrency)
+        hosts = {}
+        connector = aiohttp.TCPConnector(limit=self._concurrency, limit_per_host=self._per_host)
+        async with aiohttp.ClientSession(connector=connector, headers={"User-Agent": HTTP.headers["User-Agent"]}) as session:
+            checks = [self._fetch(session, limit, hosts, row) for row in rows]
+            # 先完成的先處理：解析與寫入資料庫在 event loop 執行緒內依序進行，其餘請求照常等待回應
+            for check in asyncio.as_completed(checks):
+                row, result, error = await check
+                self._handle(row, result, error, stats)
+
+    async def _fetch(self, session, limit, hosts, row):
+        """條件式 GET 單一 feed；先取得 host 名額再佔全域名額，避免同 host 排隊時佔住全域名額。"""
+        host = urlsplit(row["rss_url"]).hostname or ""
+        if host not in hosts:
+            hosts[host] = asyncio.Semaphore(self._per_host)
+        stream = FeedStream(lambda url: already_processed(row["id"], url), _feed_backlog(row))
+        try:
+            async with hosts[host], limit:
+                started = time.monotonic()
+                try:
+                    result = await asyncio.wait_for(self._get(session, row, stream), self._timeout)
+                finally:
+                    # 讀取與解析交錯進行，網路時間扣掉解析時間
+                    observe_stage("rss_fetch", time.monotonic() - started - stream.parse_seconds, feed=row["id"])
+            return row, result, None
+        except Exception as e:
+            return row, None, e
+
+    @staticmethod
+    async def _get(session, row, stream):
+        """條件式 GET 並邊讀邊解析；回傳 (status, stream, etag, last_modified)，304 時 stream 為 None。"""
+        headers = _conditional_headers(row["etag"], row["last_modified"])
+        async with session.get(row["rss_url"], headers=headers) as resp:
+            if resp.status == 304:
+                return 304, None, row["etag"], row["last_modified"]
+            resp.raise_for_status()
+            async for chunk in resp.content.iter_chunked(FEED_CHUNK_BYTES):
+                if stream.feed(chunk):
+                    break
+            else:
+                stream.close()
+            return resp.status, stream, resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+
+    def _handle(self, row, result, error, stats):
         feed_id = row["id"]
-        interval_min = row["schedule_minutes"]
-        last = row["last_run_at"]
-        run = False
-        if not last:
-            run = True
+        try:
+            if error is not None:
+                raise error
+            status, stream, etag, last_modified = result
+            if status == 304:
+                _count_feed_fetch("not_modified")
+                episodes, content_hash = None, row["content_hash"]
+            else:
+                stats["bytes"] += stream.bytes_read
+                episodes, content_hash = _finish_feed_stream(stream, row["content_hash"], feed_id)
+            pending = pending_episodes(row, episodes)
+        except Exception as e:
+            message = f"逾時（{self._timeout} 秒）" if isinstance(e, asyncio.TimeoutError) else str(e) or type(e).__name__
+            stats["errors"] += 1
+            with transaction() as conn:
+                conn.execute("UPDATE feeds SET last_error = ? WHERE id = ?", (f"RSS 檢查失敗：{message}", feed_id))
+                reschedule_feed(feed_id, failed=True)
+            print(f"[rasrss] RSS 檢查失敗 {row['rss_url']}: {message}")
+            return
+        try:
+            dispatch_feed(row, pending, etag, last_modified, content_hash, PRIORITY_SCHEDULED)
+        except LeaseLost:
+            return
+        if pending:
+            stats["new_feeds"] += 1
+            stats["episodes"] += len(pending)
+
+
+POLLER = FeedPoller(POLL_CONCURRENCY, POLL_PER_HOST, POLL_FEED_TIMEOUT)
+
+
+class LeaseLost(Exception):
+    """排程租約已被其他行程接手（或已過期）：不再寫入結果或發佈，交給新的持有者。"""
+
+
+class Lease:
+    """SQLite 租約：同一時間只有一個行程持有，持有者需在 ttl 秒內續約，否則其他行程可取得。
+
+    address 為持有者的內部狀態端點，API 行程由此找到排程行程。
+    """
+
+    def __init__(self, name, ttl):
+        self.name = name
+        self.ttl = ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.address = None
+        self.renewed_at = 0.0
+        self.expires_at = 0.0
+
+    def try_acquire(self):
+        """租約空著、已過期或本來就由自己持有時取得（續約），回傳是否持有。"""
+        now = time.time()
+        with transaction() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO leases (name, holder, address, expires_at) VALUES (?, ?, ?, 0)",
+                (self.name, self.holder, self.address),
+            )
+            cur = conn.execute(
+                "UPDATE leases SET holder = ?, address = ?, expires_at = ? "
+                "WHERE name = ? AND (holder = ? OR expires_at < ?)",
+                (self.holder, self.address, now + self.ttl, self.name, self.holder, now),
+            )
+        if cur.rowcount:
+            self.renewed_at = now
+            self.expires_at = now + self.ttl
+        return bool(cur.rowcount)
+
+    def release(self):
+        with transaction() as conn:
+            conn.execute("UPDATE leases SET expires_at = 0 WHERE name = ? AND holder = ?", (self.name, self.holder))
+        self.expires_at = 0.0
+
+    def check(self, conn):
+        """租約不再由本行程持有（或已過期）時拋出 LeaseLost。"""
+        row = conn.execute(
+            "SELECT 1 FROM leases WHERE name = ? AND holder = ? AND expires_at >= ?", (self.name, self.holder, time.time())
+        ).fetchone()
+        if row is None:
+            raise LeaseLost(f"排程租約已不在本行程（{self.holder}）")
+
+    def holder_address(self):
+        """目前有效持有者的 address（自己持有或無人持有時為 None）。"""
+        row = get_db().execute(
+            "SELECT holder, address FROM leases WHERE name = ? AND expires_at >= ?", (self.name, time.time())
+        ).fetchone()
+        if row is None or row["holder"] == self.holder:
+            return None
+        return row["address"]
+
+
+class Pipeline:
+    """排程與轉錄（JOBS、PUBLISHER、POLLER）只在持有排程租約的行程啟動，其餘行程只提供 API。
+
+    未取得租約的行程待命，每 LEASE_RENEW_SECONDS 秒重試；持有者結束時釋放租約，當機則在 LEASE_TTL_SECONDS 後由待命者接手。
+    續約失敗（已被接手）時停止排程與轉錄、回到待命，API（開發模式同一個行程）照常服務；
+    尚未執行與延後中的工作不會遺失：其 feed 的下次檢查時間設為現在，由接手的行程重新排入；
+    仍在執行的工作在寫入與發佈前經 fence() 確認租約，不會與接手的行程重複寫入逐字稿或同時 push。
+    """
+
+    def __init__(self, lease):
+        self.lease = lease
+        self.active = False
+        self._stop = threading.Event()
+        self._lock = threading.Lock()  # stop()（主執行緒）與失去租約（排程執行緒）可能同時停用
+        self._thread = None
+
+    def start(self, address=None):
+        """在背景執行緒執行 run()（開發模式：API 與排程同一個行程）。"""
+        self._thread = threading.Thread(target=self.run, args=(address,), name="rasrss-pipeline", daemon=True)
+        self._thread.start()
+
+    def run(self, address=None, serve_status=False):
+        """等到取得租約後啟動排程與轉錄，之後持續續約並取出 API 行程留下的請求，直到 stop()；
+        失去租約時回到待命。
+
+        serve_status=True 時在 127.0.0.1 開內部狀態端點（同一個 Flask app），供 API 行程轉送工作狀態與事件。
+        """
+        self.lease.address = address
+        while not self._stop.is_set():
+            while not self.lease.try_acquire():
+                if self._stop.wait(LEASE_RENEW_SECONDS):
+                    return
+            if serve_status:
+                serve_status = False
+                self.lease.address = self._serve_status()
+                self.lease.try_acquire()
+            self.active = True
+            print(f"[rasrss] 已取得排程租約（{self.lease.holder}），開始排程與轉錄")
+            JOBS.start()
+            PUBLISHER.start()
+            POLLER.start()
+            while not self._stop.wait(PIPELINE_INTAKE_SECONDS):
+                try:
+                    self._take_requests()
+                except Exception as e:
+                    print(f"[rasrss] 讀取排程請求失敗: {e}")
+                if time.time() - self.lease.renewed_at >= LEASE_RENEW_SECONDS and not self._renew():
+                    self._deactivate(lost=True)
+                    break
+
+    def stop(self):
+        """停止排程、發佈尚未送出的逐字稿並釋放租約（程式結束前呼叫）；執行中的轉錄不等待。"""
+        self._stop.set()
+        self._deactivate()
+
+    def fence(self, conn=None):
+        """寫入轉錄結果或發佈前呼叫：曾取得租約但已失去時拋出 LeaseLost。
+
+        在寫入交易的最後傳入 conn 呼叫：交易已持有寫入鎖，其他行程無法在檢查後、提交前接手。
+        從未使用租約（例如 bench 直接啟動工作佇列）時不檢查。
+        """
+        if self.lease.renewed_at:
+            self.lease.check(conn or get_db())
+
+    def _deactivate(self, lost=False):
+        """停止輪詢與工作佇列（未執行的工作交給下一個持有者）並釋放租約。
+
+        正常結束時發佈尚未送出的逐字稿；失去租約時改為暫停發佈（等待進行中的 push 結束），由接手的行程補發。
+        仍在執行的工作不等待：寫入與發佈前會經 fence() 確認租約，失去租約時放棄結果。
+        """
+        with self._lock:
+            if not self.active:
+                return
+            self.active = False
+        POLLER.stop()
+        JOBS.stop(on_cancel=self._hand_over)
+        if lost:
+            PUBLISHER.suspend()
         else:
+            PUBLISHER.stop()
+        try:
+            self.lease.release()
+        except Exception as e:
+            print(f"[rasrss] 釋放排程租約失敗: {e}")
+
+    @staticmethod
+    def _hand_over(jobs):
+        run_feeds_now(job.feed_id for job in jobs if job.feed_id)
+        print(f"[rasrss] 已取消 {len(jobs)} 個未執行的工作，相關訂閱改為立即重新檢查")
+
+    def _renew(self):
+        """續約；回傳是否仍持有租約（暫時無法續約但尚未過期時視為持有）。"""
+        try:
+            if self.lease.try_acquire():
+                return True
+            reason = "租約已被其他行程取得"
+        except Exception as e:
+            if time.time() < self.lease.expires_at:
+                print(f"[rasrss] 排程租約續約失敗，稍後重試: {e}")
+                return True
+            reason = f"租約已過期（{e}）"
+        print(f"[rasrss] 失去排程租約：{reason}，停止排程與轉錄並回到待命")
+        return False
+
+    def _take_requests(self):
+        rows = get_db().execute("SELECT id, kind, feed_id FROM pipeline_requests ORDER BY id").fetchall()
+        if not rows:
+            return
+        with transaction() as conn:
+            conn.execute("DELETE FROM pipeline_requests WHERE id <= ?", (rows[-1]["id"],))
+        for row in rows:
+            if row["kind"] == "run_feed":
+                enqueue_feed(row["feed_id"], PRIORITY_MANUAL)
+        POLLER.wake()
+
+    @staticmethod
+    def _serve_status():
+        from werkzeug.serving import make_server
+
+        def internal_app(environ, start_response):
+            # 標記為內部狀態端點的請求：API 行程已限制 SSE 串流數，這裡不再重複限制
+            environ["rasrss.internal"] = True
+            return app(environ, start_response)
+
+        server = make_server("127.0.0.1", PIPELINE_STATUS_PORT, internal_app, threaded=True)
+        threading.Thread(target=server.serve_forever, name="rasrss-status", daemon=True).start()
+        return f"http://127.0.0.1:{server.server_port}"
+
+
+PIPELINE = Pipeline(Lease("scheduler", LEASE_TTL_SECONDS))
+
+
+def _queue_pipeline_request(kind, feed_id=None):
+    with transaction() as conn:
+        conn.execute(
+            "INSERT INTO pipeline_requests (kind, feed_id, created_at) VALUES (?, ?, ?)",
+            (kind, feed_id, datetime.utcnow().isoformat() + "Z"),
+        )
+
+
+def request_feed_run(feed_id):
+    """手動執行 feed：本行程是排程行程時直接排入並回傳 (job, joined)，否則交給排程行程並回傳 (None, False)。"""
+    if PIPELINE.active:
+        return enqueue_feed(feed_id, PRIORITY_MANUAL)
+    _queue_pipeline_request("run_feed", feed_id)
+    return None, False
+
+
+def request_poll():
+    """訂閱的下次檢查時間提前（新增、匯入）後通知排程輪詢。"""
+    if PIPELINE.active:
+        POLLER.wake()
+    else:
+        _queue_pipeline_request("poll")
+
+
+def pipeline_state(view):
+    """需要排程行程記憶體內狀態（工作佇列、進度事件、metrics）的端點：本行程不是排程行程時串流轉送給租約持有者。"""
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        address = None if PIPELINE.active else PIPELINE.lease.holder_address()
+        if not address:
+            return view(*args, **kwargs)
+        headers = {k: v for k, v in request.headers.items() if k in ("Accept", "Last-Event-ID")}
+        try:
+            upstream = HTTP.get(address + request.full_path, headers=headers, stream=True, timeout=(5, None))
+        except requests.RequestException as e:
+            return jsonify({"success": False, "error": f"無法連線排程行程：{e}"}), 502
+
+        def body():
             try:
-                last_dt = datetime.fromisoformat(last.replace("Z", "+00:00"))
-                delta_min = (now - last_dt).total_seconds() / 60
-                if delta_min >= interval_min:
-                    run = True
-            except Exception:
-                run = True
-        if run:
-            threading.Thread(target=run_feed_job, args=(feed_id,), daemon=True).start()
+                yield from upstream.iter_content(chunk_size=None)
+            except requests.RequestException:
+                pass  # 排程行程結束或換手：直接結束串流，EventSource 會自動重連
+            finally:
+                upstream.close()
+
+        return Response(
+            body(),
+            status=upstream.status_code,
+            content_type=upstream.headers.get("Content-Type"),
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    return wrapper
+
+
+def _search_terms(q):
+    """以空白切出搜尋詞（AND），去除空字串。"""
+    return [t for t in re.split(r"\s+", q.strip()) if t]
+
+
+def _search_date(value, end=False):
+    """日期範圍參數 YYYY-MM-DD；end=True 時回傳隔天作為不含上界。格式錯誤回傳 False。"""
+    if not value:
+        return None
+    try:
+        d = datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        return False
+    return (d + timedelta(days=1) if end else d).strftime("%Y-%m-%d")
+
+
+def _highlight(text):
+    """將 snippet 以 \x02 / \x03 標出的命中處轉為 <mark>，其餘文字做 HTML escape。"""
+    return html.escape(text).replace("\x02", "<mark>").replace("\x03", "</mark>")
+
+
+def _like_snippet(text, terms, width=SEARCH_SNIPPET_TOKENS * 2):
+    """全文索引不存原文、沒有 FTS snippet()，改在 Python 取第一個命中處前後文並標出所有搜尋詞。
+
+    FTS5 trigram 與 SQLite LIKE 都不分大小寫，標示時也不分大小寫並保留原文的大小寫；較長的詞先比對，避免重疊標示。
+    """
+    pattern = re.compile("|".join(re.escape(t) for t in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+    match = pattern.search(text)
+    start = max(0, (match.start() if match else 0) - width // 2)
+    piece = pattern.sub(lambda m: f"\x02{m.group(0)}\x03", text[start:start + width])
+    return ("…" if start else "") + piece + ("…" if start + width < len(text) else "")
+
+
+def _parse_max_backlog(value):
+    """驗證補抓上限，合法回傳整數，否則回傳 None。"""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if 1 <= value <= MAX_BACKLOG_LIMIT else None
+
+
+def _parse_transcript_cursor(value):
+    """解析 before=<created_at>,<id>；未提供回傳 None，格式錯誤回傳 False。"""
+    if not value:
+        return None
+    created_at, sep, tid = value.rpartition(",")
+    if not sep or not created_at:
+        return False
+    try:
+        return created_at, int(tid)
+    except ValueError:
+        return False
 
 
 # ------------------------- 路由 -------------------------
 
 
+@app.teardown_appcontext
+def _close_request_db(exc):
+    close_db()
+
+
 @app.route("/")
 def index():
     return render_template("index.html", schedule_options=SCHEDULE_OPTIONS)
 
 
+FEED_COLUMNS = (
+    "id, rss_url, title, schedule_minutes, max_backlog, last_run_at, last_error, next_run_at, fail_count, created_at"
+)
+
+
 @app.route("/api/feeds", methods=["GET"])
 def list_feeds():
-    conn = get_db()
-    try:
-        rows = conn.execute(
-            "SELECT id, rss_url, title, schedule_minutes, last_run_at, last_error, created_at FROM feeds ORDER BY id DESC"
-        ).fetchall()
-    except sqlite3.OperationalError:
-        rows = conn.execute(
-            "SELECT id, rss_url, title, schedule_minutes, last_run_at, created_at FROM feeds ORDER BY id DESC"
-        ).fetchall()
-    conn.close()
-    out = [dict(r) for r in rows]
-    for r in out:
-        if "last_error" not in r:
-            r["last_error"] = None
-    return jsonify(out)
+    rows = get_db().execute(f"SELECT {FEED_COLUMNS} FROM feeds ORDER BY id DESC").fetchall()
+    return jsonify([dict(r) for r in rows])
+
+
+@app.route("/api/feeds/<int:feed_id>", methods=["GET"])
+def get_feed(feed_id):
+    """單一訂閱（頁面收到工作事件後只更新該列）。"""
+    row = get_db().execute(f"SELECT {FEED_COLUMNS} FROM feeds WHERE id = ?", (feed_id,)).fetchone()
+    if not row:
+        return jsonify({"error": "找不到訂閱"}), 404
+    return jsonify(dict(row))
 
 
 @app.route("/api/feeds", methods=["POST"])
@@ -471,76 +3370,476 @@ def add_feed():
     schedule = data.get("schedule", "daily")
     if not rss_url:
         return jsonify({"success": False, "error": "請輸入 RSS 連結"}), 400
-    schedule_minutes = 1440
-    for key, minutes, _ in SCHEDULE_OPTIONS:
-        if key == schedule:
-            schedule_minutes = minutes
-            break
+    max_backlog = _parse_max_backlog(data.get("max_backlog", DEFAULT_MAX_BACKLOG))
+    if max_backlog is None:
+        return jsonify({"success": False, "error": f"補抓集數需為 1～{MAX_BACKLOG_LIMIT}"}), 400
+    schedule_minutes = _schedule_minutes(schedule)
     try:
-        title, _, _ = get_latest_mp3_from_rss(rss_url)
+        title = get_feed_title(rss_url)
     except Exception as e:
         return jsonify({"success": False, "error": f"無法讀取 RSS：{e}"}), 400
     now = datetime.utcnow().isoformat() + "Z"
-    conn = get_db()
     try:
-        conn.execute(
-            "INSERT INTO feeds (rss_url, title, schedule_minutes, created_at) VALUES (?, ?, ?, ?)",
-            (rss_url, title or "", schedule_minutes, now),
-        )
-        conn.commit()
-        feed_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        with transaction() as conn:
+            feed_id = conn.execute(
+                "INSERT INTO feeds (rss_url, title, schedule_minutes, max_backlog, next_run_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (rss_url, title or rss_url, schedule_minutes, max_backlog, now, now),
+            ).lastrowid
     except sqlite3.IntegrityError:
-        conn.close()
         return jsonify({"success": False, "error": "此 RSS 已存在"}), 400
-    conn.close()
+    # next_run_at 設為現在：新訂閱在下一輪輪詢立即檢查，之後依週期排程
+    request_poll()
     return jsonify({"success": True, "feed_id": feed_id})
 
 
+def _schedule_minutes(key, default=1440):
+    """週期選項（hourly / 6hours / daily / weekly）轉為分鐘數，未知的選項回傳 default。"""
+    for option, minutes, _ in SCHEDULE_OPTIONS:
+        if option == key:
+            return minutes
+    return default
+
+
+def _schedule_key(schedule_minutes):
+    for option, minutes, _ in SCHEDULE_OPTIONS:
+        if minutes == schedule_minutes:
+            return option
+    return None
+
+
+def parse_opml(data):
+    """取出 OPML 中所有帶 xmlUrl 的 outline（含巢狀分類），依文件順序回傳
+    [{"rss_url", "title", "schedule", "max_backlog"}, ...]；schedule / max_backlog 僅本程式匯出的 OPML 才有。"""
+    root = ElementTree.fromstring(data)
+    if _local_name(root.tag) != "opml":
+        raise ValueError("不是 OPML 文件")
+    outlines = []
+    for outline in root.iter("outline"):
+        rss_url = (outline.get("xmlUrl") or "").strip()
+        if not rss_url:
+            continue
+        outlines.append({
+            "rss_url": rss_url,
+            "title": (outline.get("title") or outline.get("text") or "").strip(),
+            "schedule": outline.get(f"{{{OPML_NAMESPACE}}}schedule"),
+            "max_backlog": _parse_max_backlog(outline.get(f"{{{OPML_NAMESPACE}}}maxBacklog")),
+        })
+    return outlines
+
+
+def _check_import(outline):
+    """驗證單一匯入的 RSS（同 add_feed：能讀取即可），回傳 (title, error)。
+
+    標題以 OPML 的 title / text 為準，沒有時用 RSS 的頻道標題（同 add_feed），都沒有才用網址。
+    """
+    try:
+        channel_title = get_feed_title(outline["rss_url"])
+    except Exception as e:
+        return None, f"無法讀取 RSS：{e}"
+    return outline["title"] or channel_title or outline["rss_url"], None
+
+
+@app.route("/api/feeds/import", methods=["POST"])
+def import_feeds():
+    """匯入 OPML 訂閱清單：同時驗證最多 IMPORT_WORKERS 個 RSS，通過者以單一交易寫入。
+
+    OPML 以 multipart 欄位 file 上傳或直接作為 request body；schedule / max_backlog（query 或表單欄位）為預設值，
+    outline 帶有本程式匯出的週期與補抓集數時以其為準。results 依 OPML 順序回報每個網址：
+    added（已新增）、exists（已訂閱）、duplicate（OPML 內重複）、invalid（無法讀取）。
+    """
+    upload = request.files.get("file")
+    data = upload.read() if upload else request.get_data()
+    if not data.strip():
+        return jsonify({"success": False, "error": "請上傳 OPML 檔案"}), 400
+    try:
+        outlines = parse_opml(data)
+    except (ElementTree.ParseError, ValueError) as e:
+        return jsonify({"success": False, "error": f"OPML 格式錯誤：{e}"}), 400
+    if not outlines:
+        return jsonify({"success": False, "error": "OPML 中沒有 RSS 訂閱（outline 需有 xmlUrl）"}), 400
+    if len(outlines) > IMPORT_MAX_FEEDS:
+        return jsonify({"success": False, "error": f"單次最多匯入 {IMPORT_MAX_FEEDS} 個訂閱"}), 400
+    schedule_minutes = _schedule_minutes(request.values.get("schedule", "daily"))
+    max_backlog = _parse_max_backlog(request.values.get("max_backlog", DEFAULT_MAX_BACKLOG))
+    if max_backlog is None:
+        return jsonify({"success": False, "error": f"補抓集數需為 1～{MAX_BACKLOG_LIMIT}"}), 400
+
+    existing = {r["rss_url"] for r in get_db().execute("SELECT rss_url FROM feeds")}
+    results, candidates, seen = [], [], set()
+    for outline in outlines:
+        result = {"rss_url": outline["rss_url"]}
+        results.append(result)
+        if outline["rss_url"] in seen:
+            result["status"] = "duplicate"
+        elif outline["rss_url"] in existing:
+            result["status"] = "exists"
+        else:
+            candidates.append((outline, result))
+        seen.add(outline["rss_url"])
+    with ThreadPoolExecutor(max_workers=IMPORT_WORKERS) as pool:
+        checks = list(pool.map(_check_import, [outline for outline, _ in candidates]))
+
+    now = datetime.utcnow().isoformat() + "Z"
+    added = 0
+    with transaction() as conn:
+        for (outline, result), (title, error) in zip(candidates, checks):
+            if error:
+                result.update(status="invalid", error=error)
+                continue
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO feeds (rss_url, title, schedule_minutes, max_backlog, next_run_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    outline["rss_url"], title or "",
+                    _schedule_minutes(outline["schedule"], schedule_minutes),
+                    outline["max_backlog"] or max_backlog, now, now,
+                ),
+            )
+            if cur.rowcount:
+                result.update(status="added", feed_id=cur.lastrowid)
+                added += 1
+            else:
+                result["status"] = "exists"  # 驗證期間已由其他請求新增
+    if added:
+        request_poll()
+    print(f"[rasrss] OPML 匯入：{len(outlines)} 個網址，新增 {added} 個")
+    return jsonify({"success": True, "added": added, "results": results})
+
+
+@app.route("/api/feeds/export", methods=["GET"])
+def export_feeds():
+    """以串流輸出所有訂閱的 OPML，週期與補抓集數寫在 rasrss 命名空間的屬性，可再由 /api/feeds/import 匯入。"""
+
+    def stream():
+        yield (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<opml version="2.0" xmlns:rasrss="{OPML_NAMESPACE}">\n'
+            f"  <head>\n    <title>rasrss 訂閱</title>\n    <dateCreated>{datetime.utcnow().isoformat()}Z</dateCreated>\n  </head>\n"
+            "  <body>\n"
+        )
+        rows = get_db().execute("SELECT rss_url, title, schedule_minutes, max_backlog FROM feeds ORDER BY id")
+        for row in rows:
+            title = html.escape(row["title"] or row["rss_url"])
+            schedule = _schedule_key(row["schedule_minutes"])
+            yield (
+                f'    <outline type="rss" text="{title}" title="{title}" xmlUrl="{html.escape(row["rss_url"])}"'
+                + (f' rasrss:schedule="{schedule}"' if schedule else "")
+                + f' rasrss:maxBacklog="{row["max_backlog"] or DEFAULT_MAX_BACKLOG}"/>\n'
+            )
+        yield "  </body>\n</opml>\n"
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype="text/x-opml",
+        headers={"Content-Disposition": 'attachment; filename="rasrss.opml"'},
+    )
+
+
+@app.route("/api/feeds/<int:feed_id>", methods=["PATCH"])
+def update_feed(feed_id):
+    """更新訂閱設定（目前僅 max_backlog：每次最多補抓幾則未處理的集數）。"""
+    data = request.get_json() or {}
+    max_backlog = _parse_max_backlog(data.get("max_backlog"))
+    if max_backlog is None:
+        return jsonify({"success": False, "error": f"補抓集數需為 1～{MAX_BACKLOG_LIMIT}"}), 400
+    with transaction() as conn:
+        cur = conn.execute("UPDATE feeds SET max_backlog = ? WHERE id = ?", (max_backlog, feed_id))
+    if not cur.rowcount:
+        return jsonify({"success": False, "error": "找不到訂閱"}), 404
+    return jsonify({"success": True, "max_backlog": max_backlog})
+
+
 @app.route("/api/feeds/<int:feed_id>", methods=["DELETE"])
 def delete_feed(feed_id):
-    conn = get_db()
-    conn.execute("DELETE FROM episode_done WHERE feed_id = ?", (feed_id,))
-    conn.execute("DELETE FROM transcripts WHERE feed_id = ?", (feed_id,))
-    conn.execute("DELETE FROM feeds WHERE id = ?", (feed_id,))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("DELETE FROM episode_done WHERE feed_id = ?", (feed_id,))
+        delete_feed_transcripts(conn, feed_id)
+        conn.execute("DELETE FROM feeds WHERE id = ?", (feed_id,))
     return jsonify({"success": True})
 
 
 @app.route("/api/transcripts", methods=["GET"])
 def list_transcripts():
+    """逐字稿列表（keyset 分頁）：只回傳伺服器端截好的預覽，全文請用 /api/transcripts/<id>。
+
+    參數：feed_id（選填）、limit（預設 20，上限 100）、before=<created_at>,<id>（上一頁回傳的 next_cursor）。
+    """
     feed_id = request.args.get("feed_id", type=int)
-    conn = get_db()
+    limit = request.args.get("limit", default=TRANSCRIPT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, TRANSCRIPT_PAGE_MAX))
+    cursor = _parse_transcript_cursor(request.args.get("before"))
+    if cursor is False:
+        return jsonify({"error": "before 參數格式應為 <created_at>,<id>"}), 400
+    where, params = [], []
     if feed_id:
-        rows = conn.execute(
-            "SELECT id, feed_id, episode_title, episode_url, mp3_url, transcript_text, created_at FROM transcripts WHERE feed_id = ? ORDER BY created_at DESC",
-            (feed_id,),
-        ).fetchall()
+        where.append("feed_id = ?")
+        params.append(feed_id)
+    if cursor:
+        where.append("(created_at, id) < (?, ?)")
+        params.extend(cursor)
+    sql = (
+        "SELECT id, feed_id, episode_title, episode_url, mp3_url, created_at, preview, transcript_length "
+        "FROM transcripts"
+    )
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+    rows = get_db().execute(sql, [*params, limit + 1]).fetchall()
+    items = [dict(r) for r in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = f"{last['created_at']},{last['id']}"
+    return jsonify({"items": items, "next_cursor": next_cursor})
+
+
+@app.route("/api/search", methods=["GET"])
+def search_transcripts():
+    """全文搜尋逐字稿（FTS5 trigram，依 bm25 排序，標題權重較高），回傳標示命中處的 snippet。
+
+    參數：q（空白分隔為 AND）、feed_id、from / to（YYYY-MM-DD，含當日）、limit、offset。
+    少於 3 字的搜尋詞無法用 trigram 索引，改以 LIKE 掃描並依時間排序。
+    """
+    if not SEARCH_AVAILABLE:
+        return jsonify({"error": "此 SQLite 不支援 FTS5 trigram，無法全文搜尋"}), 503
+    terms = _search_terms(request.args.get("q", ""))
+    if not terms:
+        return jsonify({"error": "請輸入搜尋關鍵字"}), 400
+    feed_id = request.args.get("feed_id", type=int)
+    date_from = _search_date(request.args.get("from"))
+    date_to = _search_date(request.args.get("to"), end=True)
+    if date_from is False or date_to is False:
+        return jsonify({"error": "日期格式應為 YYYY-MM-DD"}), 400
+    limit = max(1, min(request.args.get("limit", default=SEARCH_PAGE_SIZE, type=int), SEARCH_PAGE_MAX))
+    offset = max(0, request.args.get("offset", default=0, type=int))
+    where, params = [], []
+    if feed_id:
+        where.append("t.feed_id = ?")
+        params.append(feed_id)
+    if date_from:
+        where.append("t.created_at >= ?")
+        params.append(date_from)
+    if date_to:
+        where.append("t.created_at < ?")
+        params.append(date_to)
+    use_fts = all(len(t) >= 3 for t in terms)
+    conn = get_db()
+    if use_fts:
+        # 先依 bm25 排序取出本頁 id，再只對這幾筆解壓縮全文產生 snippet（contentless 索引沒有 snippet()）
+        match = " ".join('"' + t.replace('"', '""') + '"' for t in terms)
+        sql = (
+            "SELECT t.id, t.feed_id, t.episode_title, t.created_at "
+            "FROM transcripts_fts JOIN transcripts t ON t.id = transcripts_fts.rowid "
+            "WHERE transcripts_fts MATCH ?"
+        )
+        params.insert(0, match)
+        order = " ORDER BY bm25(transcripts_fts, 5.0, 1.0)"
     else:
-        rows = conn.execute(
-            "SELECT id, feed_id, episode_title, episode_url, mp3_url, transcript_text, created_at FROM transcripts ORDER BY created_at DESC"
-        ).fetchall()
-    conn.close()
-    return jsonify([dict(r) for r in rows])
+        # 少於 3 字無法用 trigram 索引：掃描解壓縮後的全文（先套用 feed / 日期條件縮小範圍）
+        like = (
+            "(inflate_transcript(b.codec, b.body) LIKE ? ESCAPE '\\' OR t.episode_title LIKE ? ESCAPE '\\')"
+        )
+        sql = (
+            "SELECT t.id, t.feed_id, t.episode_title, t.created_at "
+            "FROM transcripts t JOIN transcript_bodies b ON b.transcript_id = t.id WHERE "
+            + " AND ".join(where + [like] * len(terms))
+        )
+        like_params = []
+        for t in terms:
+            pattern = "%" + t.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            like_params += [pattern, pattern]
+        params = params + like_params
+        where = []
+        order = " ORDER BY t.created_at DESC, t.id DESC"
+    if where:
+        sql += " AND " + " AND ".join(where)
+    sql += order + " LIMIT ? OFFSET ?"
+    rows = conn.execute(sql, [*params, limit + 1, offset]).fetchall()
+    items = [dict(r) for r in rows[:limit]]
+    for item in items:
+        item["snippet"] = _highlight(_like_snippet(load_transcript_text(item["id"]) or "", terms))
+    return jsonify({
+        "items": items,
+        "next_offset": offset + limit if len(rows) > limit else None,
+        "mode": "fts" if use_fts else "like",
+    })
 
 
 @app.route("/api/transcripts/<int:tid>", methods=["GET"])
 def get_transcript(tid):
-    conn = get_db()
-    row = conn.execute(
-        "SELECT id, feed_id, episode_title, episode_url, transcript_text, created_at FROM transcripts WHERE id = ?",
+    row = get_db().execute(
+        "SELECT id, feed_id, episode_title, episode_url, created_at FROM transcripts WHERE id = ?",
         (tid,),
     ).fetchone()
-    conn.close()
     if not row:
         return jsonify({"error": "找不到逐字稿"}), 404
-    return jsonify(dict(row))
+    return jsonify({**dict(row), "transcript_text": load_transcript_text(tid) or ""})
 
 
 @app.route("/api/run-now/<int:feed_id>", methods=["POST"])
 def run_now(feed_id):
-    threading.Thread(target=run_feed_job, args=(feed_id,), daemon=True).start()
-    return jsonify({"success": True, "message": "已排入執行"})
+    job, joined = request_feed_run(feed_id)
+    if job is None:
+        return jsonify({"success": True, "message": "已交給排程行程執行", "job_id": None, "joined": False})
+    message = "此訂閱已在執行中，已加入現有工作" if joined else "已排入執行"
+    return jsonify({"success": True, "message": message, "job_id": job.id, "joined": joined})
+
+
+@app.route("/api/jobs", methods=["GET"])
+@pipeline_state
+def list_jobs():
+    """工作佇列狀態：排隊中、執行中與最近完成的工作（含等待與執行秒數）。"""
+    return jsonify(JOBS.snapshot())
+
+
+_event_slots = threading.BoundedSemaphore(EVENT_MAX_STREAMS)
+
+
+def limit_event_streams(view):
+    """同時開啟的 SSE 串流超過 EVENT_MAX_STREAMS 時回 503 與 Retry-After，避免長連線占滿 API 執行緒。
+
+    放在 pipeline_state 外層：API 行程轉送給排程行程時，佔住執行緒的是轉送的這一端，
+    排程行程的內部狀態端點（每個請求一個執行緒）不限制。名額在回應關閉時歸還。
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.environ.get("rasrss.internal"):
+            return view(*args, **kwargs)
+        if not _event_slots.acquire(blocking=False):
+            response = jsonify({"error": "同時開啟的進度串流過多，請稍後再試"})
+            response.status_code = 503
+            response.headers["Retry-After"] = str(EVENT_RETRY_SECONDS)
+            return response
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        except BaseException:
+            _event_slots.release()
+            raise
+        response.call_on_close(_event_slots.release)
+        return response
+
+    return wrapper
+
+
+@app.route("/api/events", methods=["GET"])
+@limit_event_streams
+@pipeline_state
+def job_events():
+    """工作進度事件（Server-Sent Events）：queued、running、downloading、uploading、transcribing、
+    saved、skipped、done、failed、deferred（AI 配額用盡，延後執行）、cancelled（交出排程租約，由接手的行程重新排入）（工作）
+    與 published（GitHub 發佈）。重連時依 Last-Event-ID 補送；串流最長 EVENT_STREAM_MAX_SECONDS 秒，到期由瀏覽器自動重連。"""
+    last_id = request.headers.get("Last-Event-ID", type=int)
+    q = EVENTS.subscribe(last_id)
+
+    def stream():
+        deadline = time.monotonic() + EVENT_STREAM_MAX_SECONDS
+        try:
+            yield "retry: 3000\n\n"
+            while time.monotonic() < deadline:
+                try:
+                    event = q.get(timeout=EVENT_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                data = json.dumps(event, ensure_ascii=False)
+                yield f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+        finally:
+            EVENTS.unsubscribe(q)
+
+    return Response(stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/metrics", methods=["GET"])
+@pipeline_state
+def metrics():
+    """Prometheus 抓取端點。"""
+    return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/api/stats", methods=["GET"])
+@pipeline_state
+def get_stats():
+    """執行統計（供監控抓取）：RSS 條件式 GET 的 304 / hit / miss 次數、最近一輪排程輪詢與 GitHub 發佈狀態。"""
+    with _stats_lock:
+        feed_fetch = dict(FEED_FETCH_STATS)
+    return jsonify({"feed_fetch": feed_fetch, "poller": POLLER.status(), "publisher": PUBLISHER.status()})
+
+
+@app.route("/api/model-health", methods=["GET"])
+@pipeline_state
+def get_model_health():
+    """各 AI 模型的熔斷狀態、錯誤率與延遲。"""
+    return jsonify(MODEL_HEALTH.snapshot())
+
+
+@app.route("/api/usage", methods=["GET"])
+def get_usage():
+    """AI 用量：最近 days 天（UTC）各訂閱送出的音訊分鐘數與 tokens、各模型用量，以及今日各配額已用的請求數。
+
+    全部由 model_usage 計算，API 行程可直接查詢，不必轉送給排程行程。feed_id 0 為連線測試等非訂閱呼叫。
+    """
+    days = max(1, min(request.args.get("days", default=USAGE_DEFAULT_DAYS, type=int), USAGE_MAX_DAYS))
+    since = (datetime.utcnow() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    db = get_db()
+    totals = """
+        SUM(u.requests) AS requests, SUM(u.rate_limited) AS rate_limited,
+        SUM(u.input_tokens) AS input_tokens, SUM(u.output_tokens) AS output_tokens,
+        SUM(u.audio_seconds) AS audio_seconds
+    """
+    feeds = db.execute(f"""
+        SELECT u.feed_id, f.title, f.rss_url, {totals}
+        FROM model_usage u LEFT JOIN feeds f ON f.id = u.feed_id
+        WHERE u.day >= ?
+        GROUP BY u.feed_id
+        ORDER BY audio_seconds DESC, u.feed_id
+    """, (since,)).fetchall()
+    models = db.execute(f"""
+        SELECT u.provider, u.model, {totals}
+        FROM model_usage u
+        WHERE u.day >= ?
+        GROUP BY u.provider, u.model
+        ORDER BY u.provider, requests DESC
+    """, (since,)).fetchall()
+    today = {}
+    for row in db.execute(
+        "SELECT provider, model, SUM(requests) AS n FROM model_usage WHERE day = ? GROUP BY provider, model",
+        (_utc_day(),),
+    ):
+        today[(row["provider"], row["model"])] = row["n"]
+        today[(row["provider"], None)] = today.get((row["provider"], None), 0) + row["n"]
+    quotas = []
+    for provider, provider_models in (("gemini", GEMINI_MODEL_PRIORITY), ("openrouter", OPENROUTER_FREE_MODELS)):
+        for model, per_minute, per_day in QUOTAS.limits(provider, provider_models):
+            used = today.get((provider, model), 0)
+            quotas.append({
+                "provider": provider,
+                "model": model,
+                "per_minute": per_minute,
+                "per_day": per_day,
+                "used_today": used,
+                "remaining_today": max(0, per_day - used) if per_day else None,
+            })
+
+    def usage(row):
+        return {
+            "requests": row["requests"],
+            "rate_limited": row["rate_limited"],
+            "input_tokens": row["input_tokens"],
+            "output_tokens": row["output_tokens"],
+            "audio_minutes": round(row["audio_seconds"] / 60, 1),
+        }
+
+    return jsonify({
+        "since": since,
+        "days": days,
+        "feeds": [
+            {"feed_id": r["feed_id"], "title": r["title"], "rss_url": r["rss_url"], **usage(r)} for r in feeds
+        ],
+        "models": [{"provider": r["provider"], "model": r["model"], **usage(r)} for r in models],
+        "quotas": quotas,
+    })
 
 
 @app.route("/api/settings", methods=["GET"])
@@ -549,27 +3848,44 @@ def get_settings():
     provider = _get_setting("api_provider") or "gemini"
     has_gemini = bool(_get_setting("gemini_api_key"))
     has_openrouter = bool(_get_setting("openrouter_api_key"))
+    segment_minutes, segment_parallelism = _transcribe_settings()
     return jsonify({
         "api_provider": provider,
         "has_gemini_key": has_gemini,
         "has_openrouter_key": has_openrouter,
+        "segment_minutes": segment_minutes,
+        "segment_parallelism": segment_parallelism,
     })
 
 
 @app.route("/api/settings", methods=["POST"])
 def save_settings():
-    """儲存 API 設定（provider 與 key）；key 留空則不覆蓋既有值。"""
+    """儲存設定（provider、key 與分段轉錄）；未傳入的欄位與留空的 key 不覆蓋既有值。"""
     data = request.get_json() or {}
-    provider = (data.get("api_provider") or "gemini").strip().lower()
+    updates = {}
+    if "segment_minutes" in data or "segment_parallelism" in data:
+        try:
+            segment_minutes = int(data.get("segment_minutes", _transcribe_settings()[0]))
+            segment_parallelism = int(data.get("segment_parallelism", _transcribe_settings()[1]))
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "error": "分段設定需為整數"}), 400
+        if not 0 <= segment_minutes <= MAX_SEGMENT_MINUTES:
+            return jsonify({"success": False, "error": f"每段分鐘數需為 0～{MAX_SEGMENT_MINUTES}"}), 400
+        if not 1 <= segment_parallelism <= MAX_SEGMENT_PARALLELISM:
+            return jsonify({"success": False, "error": f"同時轉錄段數需為 1～{MAX_SEGMENT_PARALLELISM}"}), 400
+        updates["segment_minutes"] = str(segment_minutes)
+        updates["segment_parallelism"] = str(segment_parallelism)
+    provider = (data.get("api_provider") or _get_setting("api_provider") or "gemini").strip().lower()
     if provider not in ("gemini", "openrouter"):
         provider = "gemini"
-    _set_setting("api_provider", provider)
+    updates["api_provider"] = provider
     gemini_key = (data.get("gemini_api_key") or "").strip()
     openrouter_key = (data.get("openrouter_api_key") or "").strip()
     if gemini_key:
-        _set_setting("gemini_api_key", gemini_key)
+        updates["gemini_api_key"] = gemini_key
     if openrouter_key:
-        _set_setting("openrouter_api_key", openrouter_key)
+        updates["openrouter_api_key"] = openrouter_key
+    _set_settings(updates)
     return jsonify({"success": True, "api_provider": provider})
 
 
@@ -600,17 +3916,92 @@ def ai_test():
             return jsonify({"success": False, "error": str(e)}), 400
 
 
+def create_app(pipeline=False):
+    """WSGI app factory（例：gunicorn "app:create_app()"）：初始化資料庫並回傳 Flask app。
+
+    預設只提供 API，不做排程與轉錄（手動執行等請求交給持有排程租約的行程）；pipeline=True 時本行程也在背景爭取排程租約。
+    """
+    init_db()
+    if pipeline:
+        PIPELINE.start()
+    return app
+
+
+def run_pipeline():
+    """排程行程：待命到取得排程租約後執行排程與轉錄；SIGTERM / Ctrl+C 時發佈尚未送出的逐字稿並釋放租約。"""
+    init_db()
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        PIPELINE.run(serve_status=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        PIPELINE.stop()
+
+
+def serve(bind, workers, threads):
+    """正式部署：啟動 gunicorn（gthread，多個 API 行程）與一個排程行程，排程行程結束時重新啟動；
+    收到 SIGTERM / Ctrl+C 時一併結束兩者。"""
+    init_db()
+    # 子行程的輸出可能導向檔案，不緩衝才能即時看到 [rasrss] 記錄
+    env = {**os.environ, "PYTHONUNBUFFERED": "1"}
+    api = subprocess.Popen([
+        sys.executable, "-m", "gunicorn",
+        "--bind", bind, "--workers", str(workers), "--threads", str(threads), "--worker-class", "gthread",
+        "--chdir", REPO_ROOT, "app:create_app()",
+    ], env=env)
+    pipeline = None
+    restart_at = 0.0
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        while api.poll() is None:
+            if pipeline is not None and pipeline.poll() is not None:
+                print(f"[rasrss] 排程行程結束（{pipeline.returncode}），{PIPELINE_RESTART_SECONDS} 秒後重新啟動")
+                pipeline = None
+                restart_at = time.monotonic() + PIPELINE_RESTART_SECONDS
+            if pipeline is None and time.monotonic() >= restart_at:
+                pipeline = subprocess.Popen([sys.executable, os.path.abspath(__file__), "pipeline"], env=env)
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        running = [proc for proc in (api, pipeline) if proc is not None and proc.poll() is None]
+        for proc in running:
+            proc.terminate()
+        for proc in running:
+            proc.wait()
+
+
 def main():
+    parser = argparse.ArgumentParser(prog="app.py", description="rasrss：RSS → 日文逐字稿（未指定指令時以開發模式啟動）")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("backfill-search", help="由逐字稿全文重建全文索引")
+    serve_parser = commands.add_parser("serve", help="正式部署：gunicorn 多行程 API + 單一排程行程")
+    serve_parser.add_argument("--bind", default=SERVE_BIND, help=f"綁定位址（預設 {SERVE_BIND}）")
+    serve_parser.add_argument("--workers", type=int, default=SERVE_WORKERS, help="API 行程數")
+    serve_parser.add_argument("--threads", type=int, default=SERVE_THREADS, help="每個 API 行程的執行緒數")
+    commands.add_parser("pipeline", help="只執行排程與轉錄（取得排程租約前待命，可多開作為備援）")
+    args = parser.parse_args()
+    if args.command == "backfill-search":
+        init_db()
+        print(f"[rasrss] 已重建全文索引：{rebuild_search_index()} 筆逐字稿")
+        return
+    if args.command == "serve":
+        serve(args.bind, args.workers, args.threads)
+        return
+    if args.command == "pipeline":
+        run_pipeline()
+        return
     init_db()
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(scheduler_tick, "interval", minutes=5)
-    scheduler.start()
+    # debug reloader 的父行程只監看檔案，排程只在實際提供服務的子行程啟動；其他行程已持有租約時待命
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        PIPELINE.start(address="http://127.0.0.1:5001")
     print("\n請在瀏覽器開啟： http://127.0.0.1:5001")
     print("或從其他裝置：   http://<此機IP>:5001\n")
     try:
         app.run(host="0.0.0.0", port=5001, debug=True)
     finally:
-        scheduler.shutdown(wait=False)
+        PIPELINE.stop()
 
 
 if __name__ == "__main__":
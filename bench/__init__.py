@@ -0,0 +1,8 @@
+"""rasrss 離線效能量測：以本機假服務取代 RSS、MP3 主機、Gemini 與 GitHub 遠端，重複量測整條流程。
+
+用法（於專案根目錄）::
+
+    python -m bench --feeds 10 --episodes 5
+
+詳細參數見 ``python -m bench --help``。
+"""
@@ -0,0 +1,201 @@
+"""python -m bench：以本機假服務跑 N 個 feed × M 集的完整流程並輸出量測結果。
+
+每一輪等同所有 feed 同時到期：跑一輪排程輪詢（POLLER.tick → 有新集數才排入 process_episode），
+等工作佇列清空後由 Publisher 一次 commit + push 到 bare 遠端。第一輪轉錄全部集數；
+第二輪 RSS 沒有新集數並記錄驗證資訊，第三輪起只剩條件式 GET（304），用來量測排程本身的開銷。
+"""
+
+import argparse
+import os
+import resource
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+
+from bench.fakes import FakeMP3Host, FakeRSSServer, install_fake_genai, make_git_remote
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+class StageRecorder:
+    """攔截 app.observe_stage，保留每個階段的原始樣本以計算 p50 / p99。"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def install(self, app):
+        original = app.observe_stage
+
+        def observe_stage(stage, seconds, model="", feed=None):
+            with self._lock:
+                self.samples[stage].append(seconds)
+            original(stage, seconds, model, feed)
+
+        app.observe_stage = observe_stage
+
+
+class LockProbe:
+    """最外層交易改以 BEGIN IMMEDIATE 先取得寫入鎖，量測等待時間與 database is locked 次數。
+
+    鎖因此比正式程式早一點取得，量到的競爭略為保守（偏高）。
+    """
+
+    def __init__(self):
+        self.waits = []
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def install(self, app):
+        original = app.transaction
+        probe = self
+
+        @contextmanager
+        def transaction():
+            conn = app.get_db()
+            if app._db_local.depth == 0 and not conn.in_transaction:
+                started = time.perf_counter()
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                except sqlite3.OperationalError:
+                    with probe._lock:
+                        probe.errors += 1
+                    raise
+                with probe._lock:
+                    probe.waits.append(time.perf_counter() - started)
+            with original() as conn:
+                yield conn
+
+        app.transaction = transaction
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m bench", description=__doc__.splitlines()[0])
+    parser.add_argument("--feeds", type=int, default=5, help="feed 數量（N）")
+    parser.add_argument("--episodes", type=int, default=4, help="每個 feed 的集數（M，上限 50）")
+    parser.add_argument("--rounds", type=int, default=3, help="排程輪數（第一輪之後沒有新集數）")
+    parser.add_argument("--workers", type=int, default=2, help="工作佇列 worker 數（RASRSS_JOB_WORKERS）")
+    parser.add_argument("--audio-seconds", type=float, default=60, help="每集音訊長度（秒，128 kbps）")
+    parser.add_argument("--segment-minutes", type=int, default=0, help="分段轉錄每段分鐘數（0 = 不分段）")
+    parser.add_argument("--segment-parallelism", type=int, default=3, help="同時轉錄段數")
+    parser.add_argument("--rss-latency", type=float, default=0.02, help="RSS 伺服器每個請求的延遲（秒）")
+    parser.add_argument("--mp3-latency", type=float, default=0.05, help="MP3 主機每個請求的延遲（秒）")
+    parser.add_argument("--upload-latency", type=float, default=0.1, help="假 Gemini 上傳延遲（秒）")
+    parser.add_argument("--processing-latency", type=float, default=0.0, help="假 Gemini 檔案變為 ACTIVE 前的處理時間（秒）")
+    parser.add_argument("--generate-latency", type=float, default=0.3, help="假 Gemini generate_content 延遲（秒）")
+    parser.add_argument("--tracemalloc", action="store_true", help="以 tracemalloc 量測 Python 配置的峰值（較慢）")
+    return parser.parse_args(argv)
+
+
+def _wait_idle(app, poll=0.05):
+    while app.JOBS.counts() != (0, 0):
+        time.sleep(poll)
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix="rasrss-bench-")
+    # 這些設定在 import app 時讀取，必須先設好
+    os.environ["RASRSS_JOB_WORKERS"] = str(args.workers)
+    os.environ["GEMINI_API_KEY"] = "bench"
+    genai = install_fake_genai(args.upload_latency, args.processing_latency, args.generate_latency)
+    import app
+
+    repo_root, remote = make_git_remote(workdir)
+    app.DATABASE = os.path.join(workdir, "bench.db")
+    app.REPO_ROOT = repo_root
+    app.PAGES_DIR = os.path.join(repo_root, "docs", "transcripts")
+    app.FILE_POLL_INITIAL = min(app.FILE_POLL_INITIAL, 0.05)
+    # 假 Gemini 不受免費方案配額限制，否則每分鐘請求數會成為瓶頸
+    app.MODEL_QUOTAS.clear()
+    stages = StageRecorder()
+    stages.install(app)
+    locks = LockProbe()
+    locks.install(app)
+    app.init_db()
+    app._set_settings({
+        "segment_minutes": str(args.segment_minutes),
+        "segment_parallelism": str(args.segment_parallelism),
+    })
+
+    mp3_host = FakeMP3Host(args.audio_seconds, args.mp3_latency)
+    rss = FakeRSSServer(mp3_host, args.episodes, args.rss_latency)
+    backlog = max(1, min(args.episodes, app.MAX_BACKLOG_LIMIT))
+    now = app.datetime.utcnow().isoformat() + "Z"
+    with app.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO feeds (rss_url, title, schedule_minutes, max_backlog, created_at) VALUES (?, ?, 60, ?, ?)",
+            [(rss.url(n), f"bench {n}", backlog, now) for n in range(1, args.feeds + 1)],
+        )
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    app.JOBS.start()
+    rounds = []
+    total_started = time.perf_counter()
+    for n in range(1, args.rounds + 1):
+        before = app.get_db().execute("SELECT COUNT(*) FROM transcripts").fetchone()[0]
+        started = time.perf_counter()
+        with app.transaction() as conn:
+            conn.execute("UPDATE feeds SET next_run_at = NULL")
+        tick = app.POLLER.tick()
+        _wait_idle(app)
+        app.PUBLISHER.stop()
+        elapsed = time.perf_counter() - started
+        after = app.get_db().execute("SELECT COUNT(*) FROM transcripts").fetchone()[0]
+        rounds.append((n, elapsed, after - before, tick["bytes"]))
+    total_elapsed = time.perf_counter() - total_started
+    peak_traced = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+
+    episodes = sum(r[2] for r in rounds)
+    expected = args.feeds * backlog
+    print(f"rasrss benchmark：{args.feeds} feeds × {args.episodes} 集，workers={args.workers}，"
+          f"音訊 {args.audio_seconds:g} 秒，分段 {args.segment_minutes} 分鐘")
+    print()
+    print("輪次  耗時(s)  新逐字稿  集/分鐘  RSS 讀取(KB)")
+    for n, elapsed, count, read in rounds:
+        print(f"{n:>4}  {elapsed:>7.2f}  {count:>8}  {count / elapsed * 60 if elapsed else 0:>7.1f}  {read / 1024:>12.1f}")
+    print(f"合計  {total_elapsed:>7.2f}  {episodes:>8}  {episodes / total_elapsed * 60:>7.1f}"
+          + ("" if episodes == expected else f"  （預期 {expected}）"))
+    print()
+    print("階段          次數     p50(ms)     p99(ms)     最大(ms)")
+    for stage in (
+        "poll_tick", "rss_fetch", "parse", "download", "upload", "wait_active", "generate", "db_write", "git_push",
+    ):
+        values = stages.samples.get(stage, [])
+        if not values:
+            continue
+        print(f"{stage:<12} {len(values):>5} {_percentile(values, 50) * 1000:>11.1f} "
+              f"{_percentile(values, 99) * 1000:>11.1f} {max(values) * 1000:>12.1f}")
+    print()
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    print(f"記憶體峰值：RSS {rss_mb:.1f} MB" + (f"，Python 配置 {peak_traced / 1024 / 1024:.1f} MB" if peak_traced else ""))
+    waits = locks.waits
+    print(f"DB 寫入鎖：{len(waits)} 次交易，等待 p50 {(_percentile(waits, 50) or 0) * 1000:.2f} ms、"
+          f"p99 {(_percentile(waits, 99) or 0) * 1000:.2f} ms、最大 {max(waits, default=0) * 1000:.2f} ms，"
+          f"database is locked {locks.errors} 次")
+    print(f"RSS 請求 {rss.requests}（304：{rss.not_modified}，提早停止解析：{app.FEED_FETCH_STATS['partial']}），MP3 請求 {mp3_host.requests}，"
+          f"Gemini 上傳 {genai.calls['upload']}、產生 {genai.calls['generate']}")
+    failed = [j for j in app.JOBS.snapshot()["finished"] if j["status"] == "failed"]
+    if failed:
+        print(f"失敗工作 {len(failed)} 個，例如：{failed[0]['error']}")
+    publisher = app.PUBLISHER.status()
+    print(f"發佈：最後 push {publisher['last_push_at'] or '無'}"
+          + (f"，錯誤 {publisher['last_error']}" if publisher["last_error"] else "") + f"（遠端 {remote}）")
+    rss.close()
+    mp3_host.close()
+
+
+if __name__ == "__main__":
+    main()
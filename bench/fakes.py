@@ -0,0 +1,279 @@
+"""本機假服務：RSS、支援 Range 的 MP3 主機、Gemini SDK 替身與 bare git 遠端。"""
+
+import http.server
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+from email.utils import formatdate
+
+# MPEG-1 Layer III、128 kbps、44.1 kHz、無 padding 的 frame：每個 417 bytes、1152 個取樣
+_FRAME_HEADER = bytes([0xFF, 0xFB, 0x90, 0x00])
+_FRAME_BYTES = 417
+_FRAME_SECONDS = 1152 / 44100
+
+
+def mp3_frame(seed):
+    """單一 MP3 frame；seed 寫入 payload，讓不同集數的內容與指紋不同。"""
+    payload = (f"{seed}|".encode() * _FRAME_BYTES)[: _FRAME_BYTES - len(_FRAME_HEADER)]
+    return _FRAME_HEADER + payload
+
+
+class FakeAudio:
+    """由同一個 frame 重複組成、可被 app.mp3_segments 切分的 MP3；依需要切出片段，不把整個檔案放在記憶體。"""
+
+    def __init__(self, seconds, seed):
+        self.frame = mp3_frame(seed)
+        self.size = max(1, int(seconds / _FRAME_SECONDS)) * _FRAME_BYTES
+        self.etag = f'"{seed}-{self.size}"'
+
+    def read(self, start, end):
+        """回傳 [start, end]（含）的 bytes。"""
+        first, last = start // _FRAME_BYTES, end // _FRAME_BYTES
+        chunk = self.frame * (last - first + 1)
+        return chunk[start - first * _FRAME_BYTES:end - first * _FRAME_BYTES + 1]
+
+    def chunks(self, start, end, chunk_frames=256):
+        step = chunk_frames * _FRAME_BYTES
+        for offset in range(start, end + 1, step):
+            yield self.read(offset, min(offset + step - 1, end))
+
+
+class _Server:
+    """在背景執行緒啟動 ThreadingHTTPServer，base_url 供產生連結。"""
+
+    def __init__(self, handler):
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self._server.server_port}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class FakeMP3Host(_Server):
+    """/ep/<feed>/<episode>.mp3：支援 HEAD、Range（206）與強 ETag，每個請求先延遲 latency 秒。"""
+
+    def __init__(self, seconds=60, latency=0.0):
+        host = self
+        self.seconds = seconds
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _begin(self):
+                with host._lock:
+                    host.requests += 1
+                time.sleep(host.latency)
+                m = re.fullmatch(r"/ep/(\d+)/(\d+)\.mp3", self.path.split("?")[0])
+                if not m:
+                    self.send_error(404)
+                    return None
+                return host.audio(int(m.group(1)), int(m.group(2)))
+
+            def _headers(self, status, length, audio):
+                self.send_response(status)
+                self.send_header("Content-Type", "audio/mpeg")
+                self.send_header("Content-Length", str(length))
+                self.send_header("Accept-Ranges", "bytes")
+                self.send_header("ETag", audio.etag)
+
+            def do_HEAD(self):
+                audio = self._begin()
+                if audio is not None:
+                    self._headers(200, audio.size, audio)
+                    self.end_headers()
+
+            def do_GET(self):
+                audio = self._begin()
+                if audio is None:
+                    return
+                start, end = 0, audio.size - 1
+                m = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+                if m:
+                    start = int(m.group(1))
+                    end = min(int(m.group(2)) if m.group(2) else end, end)
+                    self._headers(206, end - start + 1, audio)
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{audio.size}")
+                else:
+                    self._headers(200, audio.size, audio)
+                self.end_headers()
+                try:
+                    for chunk in audio.chunks(start, end):
+                        self.wfile.write(chunk)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # 指紋只讀開頭，讀夠就斷線
+
+        super().__init__(Handler)
+
+    def audio(self, feed, episode):
+        return FakeAudio(self.seconds, f"{feed}-{episode}")
+
+    def url(self, feed, episode):
+        return f"{self.base_url}/ep/{feed}/{episode}.mp3"
+
+
+class FakeRSSServer(_Server):
+    """/feed/<n>.xml：每個 feed 含 episodes 集（最新在前），支援 ETag / If-None-Match 回 304。"""
+
+    def __init__(self, mp3_host, episodes, latency=0.0):
+        rss = self
+        self.mp3_host = mp3_host
+        self.episodes = episodes
+        self.latency = latency
+        self.requests = 0
+        self.not_modified = 0
+        self._lock = threading.Lock()
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with rss._lock:
+                    rss.requests += 1
+                time.sleep(rss.latency)
+                m = re.fullmatch(r"/feed/(\d+)\.xml", self.path)
+                if not m:
+                    self.send_error(404)
+                    return
+                feed = int(m.group(1))
+                etag = f'"feed-{feed}-{rss.episodes}"'
+                if self.headers.get("If-None-Match") == etag:
+                    with rss._lock:
+                        rss.not_modified += 1
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body = rss.document(feed).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/rss+xml; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+        super().__init__(Handler)
+
+    def document(self, feed):
+        items = []
+        for episode in range(self.episodes, 0, -1):
+            url = self.mp3_host.url(feed, episode)
+            items.append(
+                f"<item><title>番組{feed} 第{episode}回</title><link>{url}.html</link>"
+                f"<pubDate>{formatdate(1_700_000_000 + episode * 3600, usegmt=True)}</pubDate>"
+                f'<enclosure url="{url}" type="audio/mpeg" length="0"/></item>'
+            )
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel>'
+            f"<title>ベンチ番組 {feed}</title>{''.join(items)}</channel></rss>"
+        )
+
+    def url(self, feed):
+        return f"{self.base_url}/feed/{feed}.xml"
+
+
+def install_fake_genai(upload_latency=0.1, processing_latency=0.0, generate_latency=0.3):
+    """以假的 google.generativeai 模組取代 Gemini SDK：上傳、檔案處理（PROCESSING → ACTIVE）與產生各自延遲。
+
+    回傳模組本身；呼叫次數記在 module.calls。
+    """
+    genai = types.ModuleType("google.generativeai")
+    genai.calls = {"upload": 0, "get_file": 0, "generate": 0}
+    lock = threading.Lock()
+    files = {}
+
+    class _File:
+        def __init__(self, name, size, ready_at):
+            self.name = name
+            self.size = size
+            self.ready_at = ready_at
+
+        @property
+        def state(self):
+            return types.SimpleNamespace(name="ACTIVE" if time.monotonic() >= self.ready_at else "PROCESSING")
+
+    def count(kind):
+        with lock:
+            genai.calls[kind] += 1
+            return genai.calls[kind]
+
+    def configure(api_key=None, **kwargs):
+        pass
+
+    def upload_file(f, mime_type=None, **kwargs):
+        size = len(f.read())
+        n = count("upload")
+        time.sleep(upload_latency)
+        audio_file = _File(f"files/bench-{n}", size, time.monotonic() + processing_latency)
+        files[audio_file.name] = audio_file
+        return audio_file
+
+    def get_file(name):
+        count("get_file")
+        return files[name]
+
+    class GenerativeModel:
+        def __init__(self, model_name, **kwargs):
+            self.model_name = model_name
+
+        def generate_content(self, contents, **kwargs):
+            count("generate")
+            time.sleep(generate_latency)
+            audio_file = contents[0]
+            text = f"これはベンチマーク用の逐字稿です。{audio_file.name}（{audio_file.size} bytes）。" * 20
+            return types.SimpleNamespace(text=text)
+
+    genai.configure = configure
+    genai.upload_file = upload_file
+    genai.get_file = get_file
+    genai.GenerativeModel = GenerativeModel
+    google = sys.modules.get("google")
+    if google is None:
+        google = types.ModuleType("google")
+        google.__path__ = []
+        sys.modules["google"] = google
+    google.generativeai = genai
+    sys.modules["google.generativeai"] = genai
+    return genai
+
+
+def make_git_remote(root=None):
+    """建立 bare 遠端與已設定 origin、完成首次 push 的工作目錄，回傳 (工作目錄, 遠端路徑)。"""
+    root = root or tempfile.mkdtemp(prefix="rasrss-bench-")
+    remote = os.path.join(root, "remote.git")
+    work = os.path.join(root, "work")
+    env = {**os.environ, "GIT_AUTHOR_NAME": "bench", "GIT_AUTHOR_EMAIL": "bench@localhost",
+           "GIT_COMMITTER_NAME": "bench", "GIT_COMMITTER_EMAIL": "bench@localhost"}
+
+    def git(*args, cwd=None):
+        subprocess.run(["git", *args], cwd=cwd, env=env, check=True, capture_output=True)
+
+    git("init", "--bare", remote)
+    git("init", work)
+    git("config", "user.name", "bench", cwd=work)
+    git("config", "user.email", "bench@localhost", cwd=work)
+    os.makedirs(os.path.join(work, "docs", "transcripts"))
+    with open(os.path.join(work, "docs", "index.html"), "w", encoding="utf-8") as f:
+        f.write("<!DOCTYPE html>\n")
+    git("add", ".", cwd=work)
+    git("commit", "-m", "init", cwd=work)
+    git("remote", "add", "origin", remote, cwd=work)
+    git("push", "-u", "origin", "HEAD", cwd=work)
+    return work, remote